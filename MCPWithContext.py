@@ -7,9 +7,9 @@ import os
 import logging
 import time
 import json
-from typing import Dict, List, Any, Optional, Union, Tuple
+from typing import Dict, List, Any, Optional, Union, Tuple, AsyncIterator
 
-from app.models.mcp_engine import generate_response
+from app.models.mcp_engine import generate_response, stream_response
 from app.config import settings
 
 logger = logging.getLogger(__name__)
@@ -126,6 +126,31 @@ class MCPWithContext:
                 "timestamp": time.time()
             }
     
+    async def stream(self, question: str, context: str) -> AsyncIterator[str]:
+        """
+        使用给定上下文流式回答用户问题
+        
+        Args:
+            question: 用户问题
+            context: 上下文文本
+        
+        Yields:
+            模型生成的文本片段
+        """
+        logger.info(f"MCPWithContext流式接收问题: {question}，上下文长度: {len(context)} 字符")
+        
+        prompt = self.prompt_template.format(
+            context=context,
+            question=question
+        )
+        
+        async for token in stream_response(
+            prompt=prompt,
+            model=self.model,
+            api_key=self.api_key
+        ):
+            yield token
+    
     def _calculate_confidence(self, answer: str) -> float:
         """
         计算回答的置信度
@@ -7,7 +7,7 @@ import logging
 import time
 import random
 import json
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, AsyncIterator
 
 from app.models.MCPWithContext import MCPWithContext
 from app.models.SimpleRAG import SimpleRAG
@@ -22,11 +22,16 @@ logger = logging.getLogger(__name__)
 class SimpleMCPWithRAG:
     """极简化版MCP+RAG引擎"""
     
-    def __init__(self):
-        """初始化简化版MCP+RAG引擎"""
+    def __init__(self, rag_engine: Optional[SimpleRAG] = None):
+        """
+        初始化简化版MCP+RAG引擎
+        
+        Args:
+            rag_engine: 共享的SimpleRAG实例，未提供时自行加载索引
+        """
         self.mcp = MCPWithContext()
         # 使用RAGAdapter适配SimpleRAG，避免接口不一致问题
-        self.rag = RAGAdapter(SimpleRAG(rebuild_index=False))
+        self.rag = RAGAdapter(rag_engine or SimpleRAG(rebuild_index=False))
         logger.info("极简化版MCP+RAG引擎初始化完成")
         
     async def query(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
@@ -193,6 +198,36 @@ class SimpleMCPWithRAG:
                 "error_message": str(e)
             }
     
+    async def stream_query(self, question: str, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        流式处理用户问题，逐段返回回答文本
+        
+        Args:
+            question: 用户问题
+            session_id: 会话ID
+        
+        Yields:
+            回答文本片段
+        """
+        logger.info(f"SimpleMCPWithRAG流式接收问题: {question}")
+        
+        docs = await self.rag.search(question)
+        contexts = [doc.get("content", "") for doc in docs or [] if doc.get("content")]
+        
+        # 没有可用上下文时直接返回备用回答
+        if not contexts:
+            logger.warning(f"未找到与问题相关的文档: {question}")
+            yield await generate_backup_answer(question)
+            return
+        
+        # 限制上下文总长度，防止过长
+        full_context = "\n\n".join(contexts)
+        if len(full_context) > 6000:
+            full_context = full_context[:6000] + "..."
+        
+        async for token in self.mcp.stream(question, full_context):
+            yield token
+    
     async def route_query(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         统一的查询路由方法，提供标准化响应
@@ -241,6 +276,15 @@ class SimpleMCPWithRAG:
                 "session_id": session_id or f"session_{int(time.time())}"
             }
             
+    async def rebuild_index(self) -> bool:
+        """
+        重建当前使用的检索索引，与其他引擎共享同一索引对象时一并生效
+        
+        Returns:
+            是否重建成功
+        """
+        return await self.rag.rebuild_index()
+    
     async def diagnose(self) -> Dict[str, Any]:
         """系统诊断"""
         try:
@@ -163,7 +163,10 @@ class SimpleRAG:
         return os.path.exists(index_file) and os.path.exists(docs_file) and os.path.exists(comp_file)
     
     def _build_index(self):
-        """构建文本索引"""
+        """
+        构建文本索引
+        先在局部变量中构建，完成后整体替换，重建期间查询仍使用旧索引
+        """
         logger.info("开始构建文本索引...")
         
         # 检查知识库路径
@@ -171,10 +174,9 @@ class SimpleRAG:
             logger.error(f"知识库路径不存在: {self.knowledge_base_path}")
             return
         
-        # 清空现有索引
-        self.index = {}
-        self.documents = {}
-        self.competition_docs = defaultdict(list)
+        index = {}
+        documents = {}
+        competition_docs = defaultdict(list)
         
         # 处理所有PDF文件
         pdf_files = []
@@ -213,7 +215,7 @@ class SimpleRAG:
                         doc_key = f"doc_{doc_id}"
                         
                         # 存储文档内容
-                        self.documents[doc_key] = {
+                        documents[doc_key] = {
                             "content": chunk,
                             "source": file_name,
                             "page": page_num + 1,
@@ -223,19 +225,21 @@ class SimpleRAG:
                         # 分词并创建索引 - 使用新的参数
                         keywords = self._extract_keywords(chunk, max_count=self.max_keywords_per_chunk, for_query=False)
                         for keyword in keywords:
-                            if keyword not in self.index:
-                                self.index[keyword] = []
-                            self.index[keyword].append(doc_key)
+                            if keyword not in index:
+                                index[keyword] = []
+                            index[keyword].append(doc_key)
                         
                         # 按竞赛类型索引
                         if competition_type:
-                            self.competition_docs[competition_type].append(doc_key)
+                            competition_docs[competition_type].append(doc_key)
                 
                 logger.info(f"索引文件: {file_name}, 竞赛类型: {competition_type or '未知'}")
             
             except Exception as e:
                 logger.error(f"处理文件 {pdf_path} 时出错: {str(e)}")
         
+        self.index, self.documents, self.competition_docs = index, documents, competition_docs
+        
         # 保存索引
         self._save_index()
         logger.info(f"索引构建完成，包含 {doc_id} 个文档片段，{len(self.index)} 个关键词")
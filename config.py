@@ -5,6 +5,7 @@
 import os
 import logging
 import sys
+import functools
 from typing import Dict, Optional, List, Any
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
@@ -41,6 +42,7 @@ def get_project_root():
 PROJECT_ROOT = get_project_root()
 
 # 规范化路径，避免编码问题
+@functools.lru_cache(maxsize=128)
 def normalize_path(path):
     """标准化路径，避免编码问题"""
     # 转换为前斜杠格式以提高跨平台兼容性
@@ -116,6 +118,7 @@ class Settings(BaseSettings):
     RAG_CHUNK_SIZE: int = Field(default=1500, description="RAG文本分块大小")
     RAG_CHUNK_OVERLAP: int = Field(default=400, description="RAG文本分块重叠大小")
     RAG_SCORE_THRESHOLD: float = Field(default=0.03, description="RAG相似度阈值")
+    RAG_CONFIDENCE_THRESHOLD: float = Field(default=0.7, description="RAG回答置信度阈值，低于该值时改用MCP引擎")
     
     # 新增的RAG微调参数
     MAX_KEYWORDS_PER_QUERY: int = Field(default=20, description="针对用户查询提取的最大关键词数量")
@@ -186,6 +189,9 @@ class Settings(BaseSettings):
     # 会话配置
     SESSION_EXPIRE_DAYS: int = Field(default=7, description="会话过期天数")
     MAX_SESSION_HISTORY: int = Field(default=50, description="最大会话历史记录数")
+    SESSION_TTL: int = Field(default=3600, description="会话空闲过期时间(秒)")
+    MAX_SESSIONS: int = Field(default=10000, description="进程内最多保留的会话数")
+    REDIS_URL: Optional[str] = Field(default=None, description="Redis地址，配置后会话保存到Redis，多个工作进程共享")
     
     # 系统性能配置
     MAX_WORKERS: int = Field(default=4, description="最大工作进程数")
@@ -0,0 +1,81 @@
+"""
+竞赛智能客服系统 - 多关键词匹配工具
+基于Aho-Corasick自动机，一次扫描即可找出文本中出现的全部关键词
+"""
+
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+try:
+    import ahocorasick
+except ImportError:
+    # 未安装pyahocorasick时退回逐个关键词查找，结果一致，只是速度较慢
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+if ahocorasick is None:
+    logger.warning("未安装pyahocorasick，关键词匹配将使用逐词查找")
+
+class KeywordMatcher:
+    """多关键词匹配器，关键词集合在构建后保持不变"""
+
+    def __init__(self, entries: Iterable[Tuple[str, Any]]):
+        """
+        构建匹配器
+
+        Args:
+            entries: (关键词, 附加数据)序列，同一关键词可以对应多个附加数据
+        """
+        self._payloads: Dict[str, List[Any]] = {}
+        for word, payload in entries:
+            if word:
+                self._payloads.setdefault(word, []).append(payload)
+
+        self._automaton = None
+        if ahocorasick is not None and self._payloads:
+            self._automaton = ahocorasick.Automaton()
+            for word, payloads in self._payloads.items():
+                self._automaton.add_word(word, (word, payloads))
+            self._automaton.make_automaton()
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def matches(self, text: str) -> Iterator[Tuple[str, Any]]:
+        """
+        查找文本中出现的关键词
+
+        Args:
+            text: 待匹配文本
+
+        Yields:
+            (关键词, 附加数据)，每个出现的关键词只返回一次，顺序不作保证
+        """
+        if self._automaton is not None:
+            seen = set()
+            for _, (word, payloads) in self._automaton.iter(text):
+                if word in seen:
+                    continue
+                seen.add(word)
+                for payload in payloads:
+                    yield word, payload
+        else:
+            for word, payloads in self._payloads.items():
+                if word in text:
+                    for payload in payloads:
+                        yield word, payload
+
+    def search(self, text: str) -> bool:
+        """
+        判断文本中是否出现任一关键词
+
+        Args:
+            text: 待匹配文本
+
+        Returns:
+            是否至少命中一个关键词
+        """
+        if self._automaton is not None:
+            return next(self._automaton.iter(text), None) is not None
+        return any(word in text for word in self._payloads)
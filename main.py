@@ -4,21 +4,24 @@
 """
 
 import os
+import re
 import logging
-import json
 import time
 import asyncio
-from typing import Dict, List, Any, Optional
-import uuid
+from typing import Dict, List, Any, Optional, AsyncIterator
+import itertools
+import orjson
 from datetime import datetime
 import sys
 
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException, Depends
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from cachetools import TTLCache
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 
 # 导入配置和模型
 from app.config import settings as config, normalize_path
@@ -28,19 +31,25 @@ from app.models.MCPWithContext import MCPWithContext
 
 # 导入中间件和工具
 from app.utils.middleware import EnhancedRequestMiddleware
-from app.utils.question_enhancer import enhance_question, is_low_quality_answer, generate_backup_answer
+from app.utils.question_enhancer import enhance_question, enhance_question_async, is_low_quality_answer, generate_backup_answer, ENHANCE_TIMEOUT
 from app.utils.response_formatter import standardize_response, format_error_response
 
 # 引入结构化知识库和查询路由器
 from app.models.structured_kb import StructuredCompetitionKB
 from app.models.query_router import QueryRouter
 
+# 常用路径，导入时解析一次
+_LOG_PATH = normalize_path("logs/app.log")
+_STATIC_DIR = normalize_path("app/static")
+_TEMPLATES_DIR = normalize_path("app/templates")
+_LOGS_DIR = normalize_path("logs")
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     handlers=[
-        logging.FileHandler(normalize_path("logs/app.log"), encoding='utf-8'),
+        logging.FileHandler(_LOG_PATH, encoding='utf-8'),
         logging.StreamHandler()
     ]
 )
@@ -66,40 +75,82 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 压缩较大的回答内容；最后添加的中间件位于最外层，保证请求增强中间件看到的是未压缩的JSON
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # 挂载静态文件
-app.mount("/static", StaticFiles(directory=normalize_path("app/static")), name="static")
+app.mount("/static", StaticFiles(directory=_STATIC_DIR), name="static")
 
 # 设置模板
-templates = Jinja2Templates(directory=normalize_path("app/templates"))
+templates = Jinja2Templates(directory=_TEMPLATES_DIR)
+
+# 首页模板不依赖请求数据，启动时渲染一次后直接复用
+_INDEX_HTML = templates.get_template("index.html").render({"request": None})
 
-# 初始化简化版MCP+RAG引擎
-qa_engine = SimpleMCPWithRAG()
+# 问答引擎在startup_event中创建，各引擎共享同一个SimpleRAG索引对象
+qa_engine: Optional[QueryRouter] = None
 
 # 定义请求和响应模型
 class QuestionRequest(BaseModel):
     """问题请求模型"""
+    model_config = ConfigDict(str_strip_whitespace=True, extra='ignore')
+
     text: str  # 前端传入的问题字段
     session_id: Optional[str] = None
 
 class RebuildIndexRequest(BaseModel):
     """重建索引请求模型"""
+    model_config = ConfigDict(extra='ignore')
+
     force: bool = False
 
-# 会话存储
-active_sessions = {}
+# 重建索引锁，避免并发重建
+_rebuild_lock = asyncio.Lock()
+
+# 会话存储，按最大数量和过期时间自动淘汰，避免长期运行时内存无限增长
+active_sessions: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+# 会话ID生成：进程启动时取一次随机前缀，之后用递增计数器区分连接
+_SESSION_NONCE = os.urandom(4).hex()
+_session_counter = itertools.count()
+
+def _new_session_id(prefix: str) -> str:
+    """生成进程内唯一的会话ID，避免每个连接都读取/dev/urandom"""
+    return f"{prefix}_{_SESSION_NONCE}{next(_session_counter):x}"
+
+# 过短的问题(如"你好")增强后没有收益，直接跳过
+_ENHANCE_SKIP = re.compile(r'^[\w\s\u4e00-\u9fff]{1,3}$')
+
+async def _maybe_enhance(question: str) -> str:
+    """
+    按需增强问题，短问题直接返回，增强失败时退回原问题
+    jieba分词属于CPU密集操作，放到线程中批量执行，避免阻塞事件循环
+    :param question: 用户问题
+    :return: 增强后的问题
+    """
+    if _ENHANCE_SKIP.match(question):
+        return question
+    try:
+        enhanced_question = await asyncio.wait_for(enhance_question_async(question), ENHANCE_TIMEOUT)
+        logger.info(f"增强后问题: {enhanced_question}")
+        return enhanced_question
+    except Exception as e:
+        logger.error(f"问题增强失败: {str(e)}")
+        return question
 
 @app.get("/", response_class=HTMLResponse)
-async def get_home(request: Request):
+async def get_home():
     """获取首页"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return HTMLResponse(_INDEX_HTML)
 
 @app.post("/api/ask")
 async def ask_question(request: QuestionRequest):
     """
     处理问题API
     """
-    start_time = time.time()
-    question = request.text.strip()
+    # 耗时统计使用事件循环的单调时钟，不受系统时间调整影响
+    start_time = asyncio.get_running_loop().time()
+    question = request.text  # 首尾空白已由模型校验时去除
     session_id = request.session_id
     
     if not question:
@@ -107,18 +158,13 @@ async def ask_question(request: QuestionRequest):
         return standardize_response({
             "answer": "问题不能为空", 
             "confidence": 0.0
-        }, session_id, start_time)
+        }, session_id, start_time).to_dict()
     
     logger.info(f"收到问题: '{question}', 会话ID: {session_id}")
     
     try:
         # 使用问题增强器处理问题
-        try:
-            enhanced_question = enhance_question(question)
-            logger.info(f"增强后问题: {enhanced_question}")
-            question = enhanced_question
-        except Exception as e:
-            logger.error(f"问题增强失败: {str(e)}")
+        question = await _maybe_enhance(question)
         
         # 使用统一查询引擎处理问题，加入超时保护
         try:
@@ -131,18 +177,54 @@ async def ask_question(request: QuestionRequest):
             return standardize_response({
                 "answer": "处理您的问题时花费了太长时间，请尝试简化问题或稍后再试。",
                 "confidence": 0.3
-            }, session_id, start_time)
+            }, session_id, start_time).to_dict()
         
         # 使用响应格式化工具确保一致性
         response = standardize_response(result, session_id, start_time)
         
-        logger.info(f"问题处理完成，置信度: {response.get('confidence', 'N/A')}, 耗时: {response.get('processing_time', 'N/A')}秒")
-        return response
+        logger.info(f"问题处理完成，置信度: {response.confidence}, 耗时: {response.processing_time}秒")
+        return response.to_dict()
         
     except Exception as e:
         logger.error(f"处理问题时出错: {str(e)}", exc_info=True)
         # 使用错误响应格式化工具
-        return format_error_response(e, session_id, start_time)
+        return format_error_response(e, session_id, start_time).to_dict()
+
+async def _sse_wrap(tokens: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """
+    将回答文本片段包装为SSE事件
+    :param tokens: 回答文本片段
+    :return: SSE事件字节流
+    """
+    try:
+        async for token in tokens:
+            yield b"data: " + orjson.dumps({"token": token}) + b"\n\n"
+    except Exception as e:
+        logger.error(f"流式回答出错: {str(e)}", exc_info=True)
+        yield b"data: " + orjson.dumps({"error": str(e)}) + b"\n\n"
+    yield b"data: " + orjson.dumps({"done": True}) + b"\n\n"
+
+@app.post("/api/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """
+    流式问答API，以SSE逐段返回模型生成的回答
+    """
+    question = request.text
+    if not question:
+        raise HTTPException(status_code=400, detail="问题不能为空")
+    
+    logger.info(f"收到流式问题: '{question}', 会话ID: {request.session_id}")
+    question = await _maybe_enhance(question)
+    
+    return StreamingResponse(
+        _sse_wrap(qa_engine.stream_query(question=question, session_id=request.session_id)),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "Content-Encoding": "identity"  # 跳过GZip中间件，避免压缩缓冲导致逐字输出被攒批
+        }
+    )
 
 @app.post("/api/rebuild_index")
 async def rebuild_index(request: RebuildIndexRequest):
@@ -154,10 +236,15 @@ async def rebuild_index(request: RebuildIndexRequest):
     try:
         logger.info("收到重建索引请求")
         
-        # 简化版引擎不支持直接重建索引，使用原有引擎重建
-        from app.models.SimpleRAG import SimpleRAG
-        rag = SimpleRAG(rebuild_index=True)
+        if qa_engine is None:
+            return {"status": "error", "message": "系统尚未初始化完成"}
         
+        async with _rebuild_lock:
+            # 直接重建在线引擎共享的索引对象，无需重启即可生效
+            success = await qa_engine.rebuild_index()
+        
+        if not success:
+            return {"status": "error", "message": "重建索引失败"}
         return {"status": "success", "message": "索引重建成功"}
     except Exception as e:
         logger.error(f"重建索引时出错: {str(e)}")
@@ -179,7 +266,8 @@ async def get_status():
             "status": "ok",
             "version": config.VERSION,
             "uptime": time.time() - start_time,
-            "diagnostics": diag
+            "diagnostics": diag,
+            "enhance_cache": enhance_question.cache_info()._asdict()
         }
     except Exception as e:
         logger.error(f"获取系统状态时出错: {str(e)}")
@@ -188,20 +276,43 @@ async def get_status():
             "message": f"获取系统状态时出错: {str(e)}"
         }
 
+async def _receive_ws_json(websocket: WebSocket) -> Dict[str, Any]:
+    """
+    接收一条WebSocket消息并用orjson解析，兼容文本帧和二进制帧
+    :param websocket: WebSocket连接
+    :return: 解析后的消息
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    raw = message.get("bytes")
+    if raw is None:
+        raw = message.get("text", "")
+    return orjson.loads(raw)
+
+async def _send_ws_json(websocket: WebSocket, payload: Dict[str, Any]):
+    """
+    使用orjson序列化并以文本帧发送，保持客户端的JSON.parse用法不变
+    :param websocket: WebSocket连接
+    :param payload: 待发送的数据
+    """
+    await websocket.send_text(orjson.dumps(payload).decode("utf-8"))
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """
     WebSocket端点，支持实时问答
     :param websocket: WebSocket连接
     """
-    session_id = f"ws_{uuid.uuid4().hex}"
+    session_id = _new_session_id("ws")
+    loop = asyncio.get_running_loop()
     
     try:
         await websocket.accept()
         logger.info(f"新WebSocket连接已建立: {session_id}")
         
         # 发送连接成功消息
-        await websocket.send_json({
+        await _send_ws_json(websocket, {
             "type": "connection_established",
             "status": "connected",
             "session_id": session_id,
@@ -211,14 +322,14 @@ async def websocket_endpoint(websocket: WebSocket):
         while True:
             try:
                 # 接收消息
-                data = await websocket.receive_json()
-                start_time = time.time()
+                data = await _receive_ws_json(websocket)
+                start_time = loop.time()
                 
                 # 处理初始化消息
                 if data.get("action") == "init" and "session_id" in data:
                     session_id = data["session_id"]
                     logger.info(f"WebSocket会话ID已更新: {session_id}")
-                    await websocket.send_json({
+                    await _send_ws_json(websocket, {
                         "type": "init_ack",
                         "session_id": session_id,
                         "status": "connected",
@@ -234,20 +345,15 @@ async def websocket_endpoint(websocket: WebSocket):
                         "answer": "请提供有效的问题",
                         "confidence": 0.0
                     }, session_id, start_time)
-                    empty_response["error"] = "问题不能为空"
+                    empty_response.error = "问题不能为空"
                     
-                    await websocket.send_json(empty_response)
+                    await _send_ws_json(websocket, empty_response.to_dict())
                     continue
                 
                 logger.info(f"WebSocket收到问题: {question} (会话: {session_id})")
                 
                 # 使用问题增强器处理问题
-                try:
-                    enhanced_question = enhance_question(question)
-                    logger.info(f"增强后问题: {enhanced_question}")
-                    question = enhanced_question
-                except Exception as e:
-                    logger.error(f"问题增强失败: {str(e)}")
+                question = await _maybe_enhance(question)
                 
                 # 使用统一查询引擎处理问题，加入超时保护
                 try:
@@ -263,17 +369,17 @@ async def websocket_endpoint(websocket: WebSocket):
                         "error": "处理超时"
                     }, session_id, start_time)
                     
-                    await websocket.send_json(timeout_response)
+                    await _send_ws_json(websocket, timeout_response.to_dict())
                     continue
                 
                 # 使用响应格式化工具确保一致性
                 response = standardize_response(result, session_id, start_time)
                 
-                logger.info(f"WebSocket问题处理完成，置信度: {response.get('confidence', 'N/A')}, 耗时: {response.get('processing_time', 'N/A')}秒")
+                logger.info(f"WebSocket问题处理完成，置信度: {response.confidence}, 耗时: {response.processing_time}秒")
                 
                 # 确保WebSocket仍然连接
                 try:
-                    await websocket.send_json(response)
+                    await _send_ws_json(websocket, response.to_dict())
                 except RuntimeError as e:
                     if "websocket disconnected" in str(e).lower():
                         logger.info(f"发送响应时WebSocket已断开: {session_id}")
@@ -284,14 +390,14 @@ async def websocket_endpoint(websocket: WebSocket):
             except WebSocketDisconnect:
                 logger.info(f"WebSocket客户端断开连接: {session_id}")
                 break
-            except json.JSONDecodeError as json_err:
+            except orjson.JSONDecodeError as json_err:
                 logger.error(f"接收到非法JSON格式数据: {str(json_err)}")
                 try:
                     error_response = format_error_response(json_err, session_id)
-                    error_response["error"] = "接收到非法JSON格式数据"
-                    error_response["answer"] = "请发送有效的JSON数据"
+                    error_response.error = "接收到非法JSON格式数据"
+                    error_response.answer = "请发送有效的JSON数据"
                     
-                    await websocket.send_json(error_response)
+                    await _send_ws_json(websocket, error_response.to_dict())
                 except Exception:
                     logger.error("无法发送错误消息，连接可能已关闭")
                     break
@@ -299,7 +405,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 logger.error(f"接收WebSocket消息时出错: {str(e)}", exc_info=True)
                 try:
                     error_response = format_error_response(e, session_id, start_time)
-                    await websocket.send_json(error_response)
+                    await _send_ws_json(websocket, error_response.to_dict())
                 except Exception:
                     logger.error("无法发送错误消息，连接可能已关闭")
                     break
@@ -315,14 +421,14 @@ async def websocket_test(websocket: WebSocket):
     简单WebSocket测试端点
     :param websocket: WebSocket连接
     """
-    test_session_id = f"test_{uuid.uuid4().hex}"
+    test_session_id = _new_session_id("test")
     
     try:
         await websocket.accept()
         logger.info(f"WebSocket测试连接已建立: {test_session_id}")
         
         # 发送欢迎消息
-        await websocket.send_json({
+        await _send_ws_json(websocket, {
             "message": "欢迎使用WebSocket测试接口",
             "status": "connected",
             "session_id": test_session_id,
@@ -342,7 +448,7 @@ async def websocket_test(websocket: WebSocket):
                     "session_id": test_session_id
                 }
                 
-                await websocket.send_json(response)
+                await _send_ws_json(websocket, response)
             except WebSocketDisconnect:
                 logger.info(f"WebSocket测试客户端断开连接: {test_session_id}")
                 break
@@ -351,7 +457,7 @@ async def websocket_test(websocket: WebSocket):
                 try:
                     # 确保连接仍然打开再发送
                     error_response = format_error_response(e, test_session_id)
-                    await websocket.send_json(error_response)
+                    await _send_ws_json(websocket, error_response.to_dict())
                 except Exception:
                     # 连接可能已关闭，忽略二次错误
                     logger.error("无法发送错误消息，连接可能已关闭")
@@ -365,7 +471,7 @@ async def websocket_test(websocket: WebSocket):
 start_time = time.time()
 
 # 初始化目录
-os.makedirs(normalize_path("logs"), exist_ok=True)
+os.makedirs(_LOGS_DIR, exist_ok=True)
 
 logger.info(f"系统启动 - 版本: {config.VERSION}")
 logger.info(f"API服务运行在: http://{config.API_HOST}:{config.API_PORT}")
@@ -388,13 +494,14 @@ async def startup_event():
             rebuild = True
             logger.info("开始重建索引...")
         
-        # 加载结构化知识库
-        structured_kb = StructuredCompetitionKB(
+        # 加载结构化知识库，重建时的文档解析(文档较多时使用多进程)放到线程中，不阻塞事件循环
+        structured_kb = await asyncio.to_thread(
+            StructuredCompetitionKB,
             docs_path=config.KNOWLEDGE_BASE_PATH,
             rebuild=rebuild
         )
         
-        # 加载语义搜索引擎
+        # 加载语义搜索引擎，由语义RAG引擎共享同一份索引
         rag_engine = SimpleRAG(
             rebuild_index=rebuild
         )
@@ -403,7 +510,7 @@ async def startup_event():
         mcp_engine = MCPWithContext()
         
         # 初始化语义RAG引擎
-        semantic_rag = SimpleMCPWithRAG()
+        semantic_rag = SimpleMCPWithRAG(rag_engine=rag_engine)
         
         # 初始化查询路由器
         qa_engine = QueryRouter(
@@ -422,10 +529,14 @@ async def startup_event():
 
 if __name__ == "__main__":
     import uvicorn
+    
     uvicorn.run(
         "app.main:app",
         host=config.API_HOST,
         port=config.API_PORT,
         reload=config.DEBUG,
-        workers=config.WORKERS
+        workers=config.WORKERS,
+        # loop和http使用默认的"auto"，已安装uvloop和httptools时自动选用，否则退回asyncio和h11
+        ws_per_message_deflate=True,  # WebSocket消息启用permessage-deflate压缩
+        log_config=None  # 沿用本模块的日志配置
     )
\ No newline at end of file
@@ -8,15 +8,41 @@ import re
 import time
 import random
 import json
-from typing import Dict, Any, List, Optional, Tuple
+import functools
+import threading
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
 from pathlib import Path
-import asyncio
+from collections import OrderedDict, defaultdict, deque
 
 from langchain_community.chat_models.tongyi import ChatTongyi
 
+from app.utils.keyword_matcher import KeywordMatcher
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 纯中文字面量多选模式，如".*(时间|日期|截止|期限)"
+_LITERAL_ALTERNATION = re.compile(r'^(?:\.\*)?\(([\u4e00-\u9fff|]+)\)(?:\.\*)?$')
+
+# 系统提示词
+SYSTEM_PROMPT = "你是一个专业的竞赛智能客服，负责回答用户关于各类竞赛的问题。"
+
+def _build_messages(prompt: str) -> List[Dict[str, str]]:
+    """构建发送给模型的消息列表"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+@functools.lru_cache(maxsize=8)
+def _get_llm(model: str, api_key: str, streaming: bool = False) -> ChatTongyi:
+    """按(模型, 密钥, 是否流式)缓存ChatTongyi客户端，避免每次调用都重新创建和校验客户端对象"""
+    return ChatTongyi(
+        model=model,
+        dashscope_api_key=api_key,
+        streaming=streaming
+    )
+
 # 添加generate_response函数
 async def generate_response(prompt: str, model: str, api_key: str) -> str:
     """
@@ -31,42 +57,34 @@ async def generate_response(prompt: str, model: str, api_key: str) -> str:
         生成的回答文本
     """
     try:
-        logger.info(f"调用模型 {model} 生成回答，提示长度: {len(prompt)}")
+        logger.info("调用模型 %s 生成回答，提示长度: %d", model, len(prompt))
         
-        # 初始化ChatTongyi模型
-        llm = ChatTongyi(
-            model=model,
-            dashscope_api_key=api_key
-        )
+        # 获取(缓存的)ChatTongyi模型
+        llm = _get_llm(model, api_key)
         
         # 构建消息列表
-        messages = [
-            {"role": "system", "content": "你是一个专业的竞赛智能客服，负责回答用户关于各类竞赛的问题。"},
-            {"role": "user", "content": prompt}
-        ]
+        messages = _build_messages(prompt)
         
-        logger.info(f"开始调用模型API")
+        logger.info("开始调用模型API")
         start_time = time.time()
         
-        # 调用大模型生成回答
+        # 调用大模型生成回答，使用原生异步接口，不占用线程池
         try:
-            response = await asyncio.to_thread(
-                lambda: llm.invoke(messages)
-            )
+            response = await llm.ainvoke(messages)
             
-            # 记录响应对象类型和属性
-            logger.info(f"模型响应类型: {type(response)}, 属性: {dir(response)}")
+            # 记录响应对象类型
+            logger.debug("模型响应类型: %s", type(response))
             
             # 提取回答内容
             if hasattr(response, 'content'):
                 answer = response.content
-                logger.info(f"从content属性提取回答，长度: {len(answer)}")
+                logger.debug("从content属性提取回答，长度: %d", len(answer))
             else:
                 answer = str(response)
-                logger.info(f"使用str(response)作为回答，长度: {len(answer)}")
+                logger.debug("使用str(response)作为回答，长度: %d", len(answer))
             
-            logger.info(f"模型生成回答成功，耗时: {time.time() - start_time:.2f}秒，回答长度: {len(answer)}")
-            logger.info(f"回答开头: {answer[:100]}...")
+            logger.info("模型生成回答成功，耗时: %.2f秒，回答长度: %d", time.time() - start_time, len(answer))
+            logger.debug("回答开头: %s...", answer[:100])
             return answer
             
         except Exception as api_error:
@@ -79,6 +97,30 @@ async def generate_response(prompt: str, model: str, api_key: str) -> str:
         logger.error(f"错误详情: {traceback.format_exc()}")
         return "抱歉，模型生成回答时出现错误，请稍后再试。"
 
+async def stream_response(prompt: str, model: str, api_key: str) -> AsyncIterator[str]:
+    """
+    使用ChatTongyi模型流式生成回答，逐段返回生成的文本
+    
+    Args:
+        prompt: 提示文本
+        model: 模型名称
+        api_key: API密钥
+        
+    Yields:
+        模型生成的文本片段
+    """
+    logger.info(f"流式调用模型 {model} 生成回答，提示长度: {len(prompt)}")
+    
+    llm = _get_llm(model, api_key, streaming=True)
+    
+    try:
+        async for chunk in llm.astream(_build_messages(prompt)):
+            if chunk.content:
+                yield chunk.content
+    except Exception as e:
+        logger.error(f"流式生成回答失败: {str(e)}")
+        yield "抱歉，模型生成回答时出现错误，请稍后再试。"
+
 # 竞赛专用术语和关键词
 COMPETITION_TERMS = {
     # 竞赛类型
@@ -117,23 +159,40 @@ COMPETITION_TERMS = {
     ]
 }
 
+# 竞赛类型集合，用于O(1)判断某个名称是否为已知竞赛
+COMPETITION_TYPES = frozenset(COMPETITION_TERMS["竞赛类型"])
+
+# 各竞赛介绍条目共用的模板和关键词，问题类型名为"{竞赛名称}_介绍"
+COMPETITION_INTRO_TEMPLATE = "{name}是面向高校学生的专业竞赛，旨在培养学生的创新能力和实践技能。具体竞赛内容和要求请参考官方通知。"
+COMPETITION_INTRO_KEYWORDS = ("介绍", "简介", "说明")
+COMPETITION_INTRO_SUFFIX = "_介绍"
+
+@functools.lru_cache(maxsize=None)
+def _competition_intro(name: str) -> Dict[str, Any]:
+    """按模板生成竞赛介绍条目，只在实际问到该竞赛时生成一次"""
+    return {
+        "answer": COMPETITION_INTRO_TEMPLATE.format(name=name),
+        "confidence": 0.8
+    }
+
 class QueryContext:
     """
     查询上下文类，用于管理用户查询的上下文信息
     跟踪用户查询历史、当前话题和相关信息
     """
     
-    def __init__(self, session_id: str, user_id: str = None):
+    def __init__(self, session_id: str, user_id: str = None, max_history_length: int = 10):
         """
         初始化查询上下文
         
         Args:
             session_id: 会话ID
             user_id: 用户ID（可选）
+            max_history_length: 保留的最大历史记录数
         """
         self.session_id = session_id
         self.user_id = user_id
-        self.history = []  # 历史查询列表
+        self.history = deque(maxlen=max_history_length)  # 历史查询列表，超出长度时丢弃最早的记录
         self.current_topic = None  # 当前话题
         self.context_data = {}  # 上下文相关数据
         self.created_at = time.time()
@@ -168,7 +227,7 @@ class QueryContext:
         Returns:
             最近的查询历史记录
         """
-        return self.history[-limit:] if self.history else []
+        return list(self.history)[-limit:] if self.history else []
     
     def update_topic(self, topic: str):
         """
@@ -223,12 +282,21 @@ class MCPEngine:
         self.config = {}
         self._load_config(config_path)
         
-        # 会话上下文
-        self.contexts = {}  # session_id -> QueryContext
+        # 会话上下文，按最近使用顺序排列，超出max_sessions时淘汰最久未使用的会话
+        self.contexts: "OrderedDict[str, QueryContext]" = OrderedDict()  # session_id -> QueryContext
+        # process_question会在多个工作线程中并发执行，两个LRU字典的查找-调整-淘汰必须整体加锁
+        self._lru_lock = threading.Lock()
         
         # 竞赛专用术语和关键词
         self.competition_terms = COMPETITION_TERMS
         
+        # 所有术语构建一个多关键词匹配器，附加数据为(类别, 在类别中的序号)
+        self._term_matcher = KeywordMatcher(
+            (term, (category, index))
+            for category, terms in self.competition_terms.items()
+            for index, term in enumerate(terms)
+        )
+        
         # 竞赛知识库
         self.knowledge_base = self._load_knowledge_base()
         
@@ -275,6 +343,29 @@ class MCPEngine:
                 "response_template": "奖项设置如下：\n1. 特等奖：{special_prize}\n2. 一等奖：{first_prize}\n3. 二等奖：{second_prize}\n4. 三等奖：{third_prize}\n{additional_prizes}"
             }
         }
+        
+        # 预编译问题模式和清理用的正则，避免每次请求重复解析
+        # 形如".*(时间|日期)"的纯字面量多选模式改为子串查找，
+        # 每个问题类型其余的模式合并为一个多选正则，一次search即可判断是否命中
+        self._literal_patterns: Dict[str, List[Tuple[str, ...]]] = {}
+        self._combined_patterns: Dict[str, Optional[re.Pattern]] = {}
+        for q_type, info in self.question_patterns.items():
+            self._literal_patterns[q_type] = []
+            regex_patterns = []
+            for p in info["patterns"]:
+                literal = _LITERAL_ALTERNATION.match(p)
+                if literal:
+                    self._literal_patterns[q_type].append(tuple(literal.group(1).split("|")))
+                else:
+                    regex_patterns.append(p)
+            self._combined_patterns[q_type] = (
+                re.compile("|".join(f"(?:{p})" for p in regex_patterns)) if regex_patterns else None
+            )
+        self._cleanup_re = re.compile(r'[^\w\s\u4e00-\u9fff]')
+        
+        # 答案缓存: 标准化问题 -> (回答, 置信度)，按LRU淘汰
+        self._answer_cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._answer_cache_size = 1024
     
     def _load_config(self, config_path: str):
         """加载配置"""
@@ -282,6 +373,7 @@ class MCPEngine:
             # 设置默认配置
             self.config = {
                 "max_history_length": 10,
+                "max_sessions": 10000,  # 最多保留的会话上下文数
                 "default_confidence_threshold": 0.6,
                 "knowledge_base_path": os.getenv("KNOWLEDGE_BASE_PATH", "data/knowledge/docs/附件1"),
                 "session_storage_path": os.getenv("SESSION_STORAGE_PATH", "data/sessions"),
@@ -296,6 +388,7 @@ class MCPEngine:
             # 使用默认配置
             self.config = {
                 "max_history_length": 10,
+                "max_sessions": 10000,
                 "default_confidence_threshold": 0.6,
                 "knowledge_base_path": "data/knowledge/docs/附件1",
                 "session_storage_path": "data/sessions",
@@ -336,15 +429,21 @@ class MCPEngine:
             }
         }
         
-        # 为每个竞赛类型添加特定知识
+        # 各问题类型的关键词，每个竞赛类型的介绍条目只登记关键词，回答按模板按需生成
+        type_keywords = {q_type: info["keywords"] for q_type, info in knowledge_base.items()}
         for competition_type in self.competition_terms["竞赛类型"]:
-            knowledge_base[f"{competition_type}_介绍"] = {
-                "answer": f"{competition_type}是面向高校学生的专业竞赛，旨在培养学生的创新能力和实践技能。具体竞赛内容和要求请参考官方通知。",
-                "keywords": [competition_type, "介绍", "简介", "说明"],
-                "confidence": 0.8
-            }
+            type_keywords[f"{competition_type}{COMPETITION_INTRO_SUFFIX}"] = (competition_type,) + COMPETITION_INTRO_KEYWORDS
         
-        self.logger.info(f"已加载预设知识库，包含{len(knowledge_base)}个问题类型")
+        # 关键词 -> 问题类型的倒排索引，问答时一次扫描即可统计各问题类型的命中数
+        self._kw_matcher = KeywordMatcher(
+            (keyword, q_type)
+            for q_type, keywords in type_keywords.items()
+            for keyword in keywords
+        )
+        self._kw_count = {q_type: max(len(keywords), 1) for q_type, keywords in type_keywords.items()}
+        self._kw_order = {q_type: order for order, q_type in enumerate(type_keywords)}
+        
+        self.logger.info(f"已加载预设知识库，包含{len(type_keywords)}个问题类型")
         return knowledge_base
     
     def get_or_create_context(self, session_id: str, user_id: Optional[str] = None) -> QueryContext:
@@ -358,9 +457,17 @@ class MCPEngine:
         Returns:
             查询上下文对象
         """
-        if session_id not in self.contexts:
-            self.contexts[session_id] = QueryContext(session_id, user_id)
-        return self.contexts[session_id]
+        with self._lru_lock:
+            context = self.contexts.get(session_id)
+            if context is not None:
+                self.contexts.move_to_end(session_id)
+                return context
+            
+            context = QueryContext(session_id, user_id, self.config["max_history_length"])
+            self.contexts[session_id] = context
+            if len(self.contexts) > self.config["max_sessions"]:
+                self.contexts.popitem(last=False)
+            return context
     
     def process_question(self, question: str, session_id: Optional[str] = None, user_id: Optional[str] = None) -> str:
         """
@@ -385,12 +492,24 @@ class MCPEngine:
             # 记录问题处理开始
             self.logger.info(f"处理问题: {question} (session_id={session_id})")
             
+            # 较长的问题不会走跟进问题分支，回答只取决于静态知识库，可以直接复用
+            cache_key = self._cleanup_re.sub('', question.lower())
+            cacheable = len(cache_key) >= 15
+            cached = self._get_cached_answer(cache_key) if cacheable else None
+            if cached is not None:
+                answer, final_confidence = cached
+                context.add_query(question, answer, final_confidence)
+                return answer
+            
             # 步骤1: 理解问题类型和意图
             question_type, confidence, competition_type = self._understand_question(question, context)
             
             # 步骤2: 从知识库中查找相关回答
             answer, final_confidence = self._generate_answer(question, question_type, competition_type, context)
             
+            if cacheable:
+                self._cache_answer(cache_key, answer, final_confidence)
+            
             # 记录到上下文
             context.add_query(question, answer, final_confidence)
             
@@ -400,6 +519,22 @@ class MCPEngine:
             self.logger.error(f"处理问题时出错: {e}")
             return "抱歉，系统处理您的问题时出现了错误，请稍后再试。"
     
+    def _get_cached_answer(self, cache_key: str) -> Optional[Tuple[str, float]]:
+        """取出缓存的(回答, 置信度)并标记为最近使用，未命中时返回None"""
+        with self._lru_lock:
+            cached = self._answer_cache.get(cache_key)
+            if cached is not None:
+                self._answer_cache.move_to_end(cache_key)
+            return cached
+    
+    def _cache_answer(self, cache_key: str, answer: str, confidence: float):
+        """缓存回答，超出容量时淘汰最久未使用的条目"""
+        with self._lru_lock:
+            self._answer_cache[cache_key] = (answer, confidence)
+            self._answer_cache.move_to_end(cache_key)
+            if len(self._answer_cache) > self._answer_cache_size:
+                self._answer_cache.popitem(last=False)
+    
     def _understand_question(self, question: str, context: QueryContext) -> Tuple[str, float, Optional[str]]:
         """
         理解问题类型和意图
@@ -413,42 +548,45 @@ class MCPEngine:
         """
         # 清理和标准化问题
         question = question.lower()
-        question = re.sub(r'[^\w\s\u4e00-\u9fff]', '', question)
+        question = self._cleanup_re.sub('', question)
         
         # 检查是否是跟进问题
         if len(question) < 15 and context.history:
             last_query = context.history[-1]["query"]
             question = f"{last_query} {question}"
         
-        # 识别竞赛类型
-        competition_type = None
-        for comp_type in self.competition_terms["竞赛类型"]:
-            if comp_type in question:
-                competition_type = comp_type
-                break
+        # 识别竞赛类型，多个命中时取列表中靠前的一个
+        comp_hits = [
+            (index, term) for term, (category, index) in self._term_matcher.matches(question)
+            if category == "竞赛类型"
+        ]
+        competition_type = min(comp_hits)[1] if comp_hits else None
         
         # 匹配问题模式
         best_match = None
         best_score = 0.0
         
-        for q_type, pattern_info in self.question_patterns.items():
-            for pattern in pattern_info["patterns"]:
-                if re.search(pattern, question):
-                    score = 0.8  # 基础匹配分数
-                    if competition_type:
-                        score += 0.1  # 如果识别出竞赛类型，增加分数
-                    if score > best_score:
-                        best_score = score
-                        best_match = q_type
+        for q_type, combined in self._combined_patterns.items():
+            matched = any(
+                any(lit in question for lit in literals)
+                for literals in self._literal_patterns[q_type]
+            ) or (combined is not None and combined.search(question) is not None)
+            if matched:
+                score = 0.8  # 基础匹配分数
+                if competition_type:
+                    score += 0.1  # 如果识别出竞赛类型，增加分数
+                if score > best_score:
+                    best_score = score
+                    best_match = q_type
         
         # 如果没有找到匹配，尝试关键词匹配
         if not best_match:
-            for q_type, info in self.knowledge_base.items():
-                score = 0
-                for keyword in info["keywords"]:
-                    if keyword in question:
-                        score += 1
-                score = score / max(len(info["keywords"]), 1)
+            hits = defaultdict(int)
+            for _, q_type in self._kw_matcher.matches(question):
+                hits[q_type] += 1
+            # 按知识库顺序比较，得分相同时保留靠前的问题类型
+            for q_type in sorted(hits, key=self._kw_order.__getitem__):
+                score = hits[q_type] / self._kw_count[q_type]
                 if score > best_score:
                     best_score = score
                     best_match = q_type
@@ -459,6 +597,27 @@ class MCPEngine:
             
         return best_match, best_score, competition_type
     
+    def _get_knowledge(self, question_type: str) -> Dict[str, Any]:
+        """
+        获取问题类型对应的知识条目
+        
+        Args:
+            question_type: 问题类型
+            
+        Returns:
+            知识条目，不存在时返回空字典
+        """
+        answer_info = self.knowledge_base.get(question_type)
+        if answer_info is not None:
+            return answer_info
+        
+        # 竞赛介绍条目按模板生成
+        if question_type.endswith(COMPETITION_INTRO_SUFFIX):
+            competition_type = question_type[:-len(COMPETITION_INTRO_SUFFIX)]
+            if competition_type in COMPETITION_TYPES:
+                return _competition_intro(competition_type)
+        return {}
+    
     def _generate_answer(self, question: str, question_type: str, competition_type: Optional[str], context: QueryContext) -> Tuple[str, float]:
         """
         生成回答
@@ -475,15 +634,7 @@ class MCPEngine:
         # 如果是未知类型或置信度太低
         if question_type == "未知":
             # 检查是否包含竞赛相关术语
-            has_competition_term = False
-            for term_category in self.competition_terms.values():
-                if isinstance(term_category, list):
-                    for term in term_category:
-                        if term in question:
-                            has_competition_term = True
-                            break
-                if has_competition_term:
-                    break
+            has_competition_term = self._term_matcher.search(question)
             
             if has_competition_term:
                 return ("抱歉，我需要更多信息来准确回答您的问题。您可以：\n"
@@ -498,13 +649,13 @@ class MCPEngine:
                        "请尝试询问这些方面的问题。", 0.4)
         
         # 获取知识库中的基础回答
-        answer_info = self.knowledge_base.get(question_type, {})
+        answer_info = self._get_knowledge(question_type)
         base_answer = answer_info.get("answer", "")
         base_confidence = answer_info.get("confidence", 0.6)
         
         # 如果有特定竞赛类型，尝试获取该竞赛的特定回答
-        if competition_type:
-            specific_answer_info = self.knowledge_base.get(f"{competition_type}_介绍", {})
+        if competition_type in COMPETITION_TYPES:
+            specific_answer_info = _competition_intro(competition_type)
             specific_answer = specific_answer_info.get("answer", "")
             if specific_answer:
                 base_answer = f"{specific_answer}\n\n{base_answer}"
@@ -3,15 +3,16 @@
 处理请求与响应，提高问答质量
 """
 
-import json
+import asyncio
 import logging
 import time
 from typing import Dict, Any, Callable, Awaitable
+import orjson
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 
 # 导入问题增强工具
-from app.utils.question_enhancer import enhance_question, is_low_quality_answer, generate_backup_answer
+from app.utils.question_enhancer import enhance_question_async, is_low_quality_answer, generate_backup_answer, ENHANCE_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
@@ -38,22 +39,23 @@ class EnhancedRequestMiddleware(BaseHTTPMiddleware):
             
             # 保存原始请求体
             body = await request.body()
+            original_question = ""
             
             try:
                 # 解析请求体
-                data = json.loads(body)
+                data = orjson.loads(body)
                 original_question = data.get("text", "")
                 
                 if original_question:
                     # 增强问题
-                    enhanced_question = enhance_question(original_question)
+                    # jieba分词属于CPU密集操作，放到线程中批量执行，避免阻塞事件循环
+                    enhanced_question = await asyncio.wait_for(enhance_question_async(original_question), ENHANCE_TIMEOUT)
                     
-                    # 创建增强版请求体
-                    data["text"] = enhanced_question
-                    data["original_question"] = original_question
-                    
-                    # 将修改后的请求体替换原始请求体
-                    body = json.dumps(data).encode()
+                    # 问题有变化时才重新生成请求体，否则沿用原始字节
+                    if enhanced_question != original_question:
+                        data["text"] = enhanced_question
+                        data["original_question"] = original_question
+                        body = orjson.dumps(data)
                     
                     # 记录增强前后的差异
                     logger.info(f"请求增强: 原始=[{original_question}], 增强后=[{enhanced_question}], 耗时={time.time()-start_time:.2f}秒")
@@ -72,16 +74,22 @@ class EnhancedRequestMiddleware(BaseHTTPMiddleware):
             # 继续处理请求
             response = await call_next(request)
             
+            # 流式或非JSON响应不缓冲，直接透传
+            content_type = response.headers.get("content-type", "")
+            if "text/event-stream" in content_type or "application/json" not in content_type:
+                return response
+            
             # 尝试对响应进行后处理
             if response.status_code == 200:
                 # 读取响应体
-                response_body = b""
+                chunks = []
                 async for chunk in response.body_iterator:
-                    response_body += chunk
+                    chunks.append(chunk)
+                response_body = b"".join(chunks)
                 
                 try:
                     # 解析响应体
-                    data = json.loads(response_body)
+                    data = orjson.loads(response_body)
                     
                     # 检查回答质量
                     answer = data.get("answer", "")
@@ -100,23 +108,22 @@ class EnhancedRequestMiddleware(BaseHTTPMiddleware):
                             data["is_backup"] = True
                             
                             logger.info(f"使用备用回答: [{backup_answer}]")
-                    
-                    # 创建新的响应体
-                    new_response_body = json.dumps(data).encode()
-                    
-                    # 返回修改后的响应
-                    return Response(
-                        content=new_response_body,
-                        status_code=response.status_code,
-                        headers=dict(response.headers),
-                        media_type=response.media_type,
-                    )
+                            
+                            # 回答被替换时才重新序列化，Content-Length由新响应体重新计算
+                            headers = dict(response.headers)
+                            headers.pop("content-length", None)
+                            return Response(
+                                content=orjson.dumps(data),
+                                status_code=response.status_code,
+                                headers=headers,
+                                media_type=response.media_type,
+                            )
                     
                 except Exception as e:
                     logger.error(f"处理响应过程中出错: {str(e)}")
                     # 失败时使用原始响应
                 
-                # 重新构建原始响应
+                # 回答未被修改，直接返回原始响应体
                 return Response(
                     content=response_body,
                     status_code=response.status_code,
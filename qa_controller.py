@@ -2,19 +2,62 @@
 竞赛智能客服系统 - 问答控制器
 处理用户问题和系统回答
 """
+import asyncio
 import logging
+import re
 from typing import Dict, Any, Optional, List, Tuple
 import uuid
 import time
+from collections import deque
+from dataclasses import dataclass, asdict
+
+from cachetools import TTLCache
 
 from ..services.knowledge.knowledge_service import KnowledgeService
 from ..models.mcp_engine import MCPEngine, QueryContext
 from ..models.RAG_LLM import RAGLLMKnowledgeBase
+from ..api.session import RedisSessionStore
 from ..config import settings
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 明显与竞赛无关的话题
+IRRELEVANT_TOPICS = ["天气", "股票", "游戏", "电影", "音乐", "旅游", "美食", "体育", "购物", "医疗", "政治"]
+
+# 开放性问题的特征词
+OPEN_QUESTION_TERMS = [
+    # 开放性问题通常以这些词开头或包含这些词
+    "为什么", "如何", "怎样", "怎么", "什么方法",
+    "哪些方式", "如果", "能否", "是否可以", "可不可以",
+    "应该", "建议", "有什么", "有哪些", "需要",
+    # 包含比较和分析的问题
+    "比较", "区别", "差异", "优缺点", "利弊", "推荐", "困难", "挑战", "问题",
+    # 包含"我"或"你"等人称代词，可能是个性化问题
+    "我", "你", "他", "她", "我们", "学生", "参赛者", "选手"
+]
+
+# 不相关话题合并为一个正则，命中第一个话题即返回
+_IRRELEVANT_RE = re.compile("|".join(map(re.escape, IRRELEVANT_TOPICS)))
+
+# 开放性问题特征词集合及其长度，按长度切片后查集合即可判断
+_OPEN_TERMS = frozenset(OPEN_QUESTION_TERMS)
+_OPEN_TERM_LENGTHS = sorted({len(term) for term in OPEN_QUESTION_TERMS})
+
+@dataclass(slots=True)
+class QAResponse:
+    """问答响应，使用__slots__减少每次回答的对象开销"""
+    session_id: str
+    question: str
+    answer: str
+    confidence: float = 0.0
+    source: str = "未知"
+    processing_time: float = 0.0
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典，便于序列化为JSON"""
+        return asdict(self)
+
 class QAController:
     """问答控制器：处理用户问题和获取答案"""
     
@@ -35,11 +78,17 @@ class QAController:
         self.mcp_engine = mcp_engine or MCPEngine()
         self.rag_llm = rag_llm
         
-        # 会话管理
-        self.sessions = {}  # 存储会话信息
+        # 会话管理，配置了Redis时以Redis为准，本地缓存本进程用到的会话
+        # 超过数量上限或空闲超过SESSION_TTL的会话由TTLCache在读写时自动淘汰
+        self.sessions: TTLCache = TTLCache(maxsize=settings.MAX_SESSIONS, ttl=settings.SESSION_TTL)
+        self.session_store = RedisSessionStore.from_settings()
+        
+        # 请求处理中用到的配置，初始化时读取一次
+        self._rag_enabled = settings.RAG_ENABLED
+        self._rag_threshold = settings.RAG_CONFIDENCE_THRESHOLD
         self.logger.info("问答控制器初始化完成")
     
-    def create_session(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+    async def create_session(self, user_id: Optional[str] = None) -> Dict[str, Any]:
         """
         创建新会话
         
@@ -50,16 +99,20 @@ class QAController:
             会话信息
         """
         session_id = str(uuid.uuid4())
+        now = time.time()
         
         # 创建会话
         self.sessions[session_id] = {
             "id": session_id,
             "user_id": user_id,
-            "created_at": time.time(),
-            "last_activity": time.time(),
-            "history": []
+            "created_at": now,
+            "last_activity": now,
+            "history": deque(maxlen=settings.MAX_SESSION_HISTORY)  # (问题, 回答, 时间戳)
         }
         
+        if self.session_store:
+            await self.session_store.create(session_id, self.sessions[session_id])
+        
         # 创建对应的查询上下文
         query_context = QueryContext(session_id, user_id)
         
@@ -69,9 +122,54 @@ class QAController:
             "created_at": self.sessions[session_id]["created_at"]
         }
     
-    def process_question(self, question: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+    async def _get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取会话信息，本地没有时从Redis加载
+        
+        Args:
+            session_id: 会话ID
+            
+        Returns:
+            会话信息，不存在时返回None
+        """
+        session = self.sessions.get(session_id)
+        if session is None and self.session_store:
+            info = await self.session_store.get(session_id)
+            if info is not None:
+                history = await self.session_store.get_history(session_id)
+                session = {
+                    "id": session_id,
+                    "user_id": info.get("user_id") or None,
+                    "created_at": float(info.get("created_at") or time.time()),
+                    "last_activity": time.time(),
+                    "history": deque(
+                        (tuple(turn) for turn in history),
+                        maxlen=settings.MAX_SESSION_HISTORY
+                    )
+                }
+                # 等待Redis期间其他请求可能已加载同一会话，以先加载的为准
+                session = self.sessions.setdefault(session_id, session)
+        return session
+    
+    async def _record(self, session_id: str, question: str, answer: str, timestamp: float):
+        """
+        记录一轮问答，同时写入Redis
+        
+        Args:
+            session_id: 会话ID
+            question: 用户问题
+            answer: 系统回答
+            timestamp: 提问时间
+        """
+        turn = (question, answer, timestamp)
+        self.sessions[session_id]["history"].append(turn)
+        if self.session_store:
+            await self.session_store.append_history(session_id, turn)
+    
+    async def process_question(self, question: str, session_id: Optional[str] = None) -> QAResponse:
         """
         处理用户问题
+        RAG与MCP引擎相互独立，同步实现的后端放到线程中并发执行，RAG置信度达标时丢弃MCP的结果
         
         Args:
             question: 用户问题
@@ -80,29 +178,26 @@ class QAController:
         Returns:
             包含答案的响应
         """
-        start_time = time.time()
+        # 处理耗时使用单调时钟，会话时间戳使用墙上时间，各取一次
+        start_time = time.monotonic()
+        now = time.time()
         
         # 获取或创建会话
-        if not session_id or session_id not in self.sessions:
-            session_info = self.create_session()
+        if not session_id or await self._get_session(session_id) is None:
+            session_info = await self.create_session()
             session_id = session_info["session_id"]
         
+        mcp_task = None
         try:
-            # 更新会话活动时间
-            self.sessions[session_id]["last_activity"] = time.time()
-            
-            # 记录问题
-            self.sessions[session_id]["history"].append({
-                "role": "user",
-                "content": question,
-                "timestamp": time.time()
-            })
+            # 更新会话活动时间，重新写入以刷新过期时间
+            session = self.sessions[session_id]
+            session["last_activity"] = now
+            self.sessions[session_id] = session
             
             # 步骤1: 检查问题是否在范围内
             in_scope = True
             # 只有明显不相关的话题才拒绝
-            irrelevant_topics = ["天气", "股票", "游戏", "电影", "音乐", "旅游", "美食", "体育", "购物", "医疗", "政治"]
-            if any(topic in question for topic in irrelevant_topics) and not self.knowledge_service.is_in_scope(question):
+            if _IRRELEVANT_RE.search(question) and not self.knowledge_service.is_in_scope(question):
                 in_scope = False
                 
             if not in_scope:
@@ -110,40 +205,42 @@ class QAController:
                 response = self._create_response(session_id, question, answer, 
                                                confidence=0.0, 
                                                source="范围检查",
-                                               processing_time=time.time() - start_time)
+                                               processing_time=time.monotonic() - start_time)
+                await self._record(session_id, question, answer, now)
                 return response
             
+            # 提前启动MCP引擎，与RAG并发执行；MCPEngine内部的LRU缓存已加锁，可在多个线程中同时调用
+            mcp_task = asyncio.create_task(asyncio.to_thread(self.mcp_engine.process_question, question))
+            
             # 步骤2: 如果启用了RAG，优先使用RAG
-            if settings.RAG_ENABLED and self.rag_llm:
+            if self._rag_enabled and self.rag_llm:
                 try:
-                    # 获取会话历史
-                    history = self.get_session_history(session_id)
-                    # 使用RAG生成答案
-                    answer, confidence = self.rag_llm.query(question, history)
+                    # rag_llm按消息字典列表读取历史，与改为按轮次存储之前一致：最近10条消息，末尾为本次提问
+                    history = self._expand_turns(session["history"], limit=9)
+                    history.append({"role": "user", "content": question, "timestamp": now})
+                    answer, confidence = await asyncio.to_thread(self.rag_llm.query, question, history)
                     
-                    if confidence >= settings.RAG_CONFIDENCE_THRESHOLD:
+                    if confidence >= self._rag_threshold:
+                        # 线程中的MCP计算无法中断，取消只是不再等待，其结果直接丢弃
+                        mcp_task.cancel()
                         response = self._create_response(session_id, question, answer,
                                                        confidence=confidence,
                                                        source="RAG",
-                                                       processing_time=time.time() - start_time)
-                        # 记录回答
-                        self.sessions[session_id]["history"].append({
-                            "role": "assistant",
-                            "content": answer,
-                            "timestamp": time.time()
-                        })
+                                                       processing_time=time.monotonic() - start_time)
+                        # 记录本轮问答
+                        await self._record(session_id, question, answer, now)
                         return response
                 except Exception as e:
                     self.logger.error(f"RAG处理失败: {e}")
             
-            # 步骤3: 使用MCP引擎处理问题
-            answer = self.mcp_engine.process_question(question)
+            # 步骤3: 使用MCP引擎的回答
+            answer = await mcp_task
             source = "MCP引擎"
             confidence = 0.8
             
             # 步骤4: 如果MCP引擎没有明确答案，使用知识服务查找
             if "抱歉" in answer and "未找到" in answer:
-                knowledge_result = self.knowledge_service.get_answer(question)
+                knowledge_result = await asyncio.to_thread(self.knowledge_service.get_answer, question)
                 
                 if knowledge_result["confidence"] > 0.4:  # 降低阈值
                     answer = knowledge_result["answer"]
@@ -151,7 +248,7 @@ class QAController:
                     source = knowledge_result["source"]
                 # 尝试智能组合回答处理开放性问题
                 elif self._is_open_question(question):
-                    partial_results = self.knowledge_service.search(question, top_k=5)
+                    partial_results = await asyncio.to_thread(self.knowledge_service.search, question, top_k=5)
                     if partial_results and len(partial_results) >= 1:  # 只需要一个相关结果就可尝试回答
                         # 组合多个部分答案形成完整回答
                         combined_answer = self._generate_composite_answer(question, partial_results)
@@ -166,112 +263,100 @@ class QAController:
             response = self._create_response(session_id, question, answer, 
                                            confidence=confidence, 
                                            source=source,
-                                           processing_time=time.time() - start_time)
+                                           processing_time=time.monotonic() - start_time)
             
-            # 记录回答
-            self.sessions[session_id]["history"].append({
-                "role": "assistant",
-                "content": answer,
-                "timestamp": time.time()
-            })
+            # 记录本轮问答
+            await self._record(session_id, question, answer, now)
             
             return response
             
         except Exception as e:
             self.logger.error(f"处理问题时出错: {e}")
-            return {
-                "session_id": session_id,
-                "question": question,
-                "answer": "抱歉，系统处理您的问题时出现了错误，请稍后再试。",
-                "confidence": 0,
-                "source": "错误处理",
-                "processing_time": time.time() - start_time
-            }
+            if mcp_task is not None and not mcp_task.done():
+                mcp_task.cancel()
+            return QAResponse(session_id, question,
+                              "抱歉，系统处理您的问题时出现了错误，请稍后再试。",
+                              confidence=0.0,
+                              source="错误处理",
+                              processing_time=time.monotonic() - start_time)
     
     def _is_open_question(self, question: str) -> bool:
         """判断是否为开放性问题"""
-        # 开放性问题通常以这些词开头或包含这些词
-        open_question_starters = [
-            "为什么", "如何", "怎样", "怎么", "什么方法", 
-            "哪些方式", "如果", "能否", "是否可以", "可不可以",
-            "应该", "建议", "有什么", "有哪些", "需要"
-        ]
-        
-        for starter in open_question_starters:
-            if starter in question:
-                return True
-                
-        # 包含比较和分析的问题
-        if any(term in question for term in ["比较", "区别", "差异", "优缺点", "利弊", "建议", "推荐", "困难", "挑战", "问题"]):
-            return True
-            
         # 如果是简短的疑问句，也视为开放性问题
-        if len(question) < 15 and question.endswith("?") or question.endswith("？"):
-            return True
-            
-        # 如果问题包含"我"或"你"等人称代词，可能是个性化问题
-        if any(term in question for term in ["我", "你", "他", "她", "我们", "学生", "参赛者", "选手"]):
+        last_char = question[-1:]
+        if last_char == "？" or (last_char == "?" and len(question) < 15):
             return True
+        
+        # 包含疑问词、比较分析类词语或人称代词：逐位置取各长度的片段查集合，命中即返回
+        for i in range(len(question)):
+            for n in _OPEN_TERM_LENGTHS:
+                if question[i:i + n] in _OPEN_TERMS:
+                    return True
             
         return False
     
     def _generate_composite_answer(self, question: str, results: List[Dict[str, Any]]) -> Optional[str]:
         """根据多个搜索结果生成组合答案"""
         try:
-            # 提取关键段落
-            key_paragraphs = []
-            for result in results:
-                if result["score"] > 0.1:  # 降低相关度阈值，接受更多的相关段落
-                    # 提取前150个字符，但尝试保持语句完整
-                    text = result["text"][:200]
-                    # 如果句子被截断，尝试在句号处截断
-                    last_period = text.rfind("。")
-                    if last_period > 100:  # 确保至少保留一定长度
-                        text = text[:last_period+1]
-                    key_paragraphs.append(text)
+            # 提取关键段落，降低相关度阈值，接受更多的相关段落
+            key_paragraphs = [
+                self._clip_paragraph(result["text"])
+                for result in results if result["score"] > 0.1
+            ]
             
             if not key_paragraphs:
                 return None
             
-            # 根据问题类型生成不同的答案模板
+            # 根据问题类型生成不同的答案模板，逐行收集后一次拼接
             if "如何" in question or "怎样" in question:
-                answer = f"您可以这样做：\n"
-                for i, para in enumerate(key_paragraphs, 1):
-                    answer += f"{i}. {para}\n"
+                lines = ["您可以这样做："]
+                lines.extend(f"{i}. {para}" for i, para in enumerate(key_paragraphs, 1))
+                lines.append("")
             elif "为什么" in question:
-                answer = f"这是因为：\n{key_paragraphs[0]}"
+                lines = ["这是因为：", key_paragraphs[0]]
                 if len(key_paragraphs) > 1:
-                    answer += f"\n\n此外：\n{key_paragraphs[1]}"
+                    lines.extend(["", "此外：", key_paragraphs[1]])
             elif "有什么" in question or "有哪些" in question:
-                answer = "主要包括以下几个方面：\n"
-                for i, para in enumerate(key_paragraphs, 1):
-                    answer += f"{i}. {para}\n"
+                lines = ["主要包括以下几个方面："]
+                lines.extend(f"{i}. {para}" for i, para in enumerate(key_paragraphs, 1))
+                lines.append("")
             else:
                 # 默认模板
-                answer = key_paragraphs[0]
+                lines = [key_paragraphs[0]]
                 if len(key_paragraphs) > 1:
-                    answer += f"\n\n补充说明：\n{key_paragraphs[1]}"
+                    lines.extend(["", "补充说明：", key_paragraphs[1]])
             
-            return answer
+            return "\n".join(lines)
             
         except Exception as e:
             self.logger.error(f"生成组合答案时出错: {e}")
             return None
     
-    def _create_response(self, session_id: str, question: str, answer: str, **kwargs) -> Dict[str, Any]:
+    @staticmethod
+    def _clip_paragraph(text: str, limit: int = 200, min_length: int = 100) -> str:
+        """
+        截取段落的前limit个字符，尽量在句号处截断以保持语句完整
+        
+        Args:
+            text: 段落文本
+            limit: 最大长度
+            min_length: 在句号处截断时至少保留的长度
+            
+        Returns:
+            截取后的段落
+        """
+        text = text[:limit]
+        # 只在min_length之后查找句号，找不到时保留截取结果
+        last_period = text.rfind("。", min_length + 1)
+        return text[:last_period + 1] if last_period != -1 else text
+    
+    def _create_response(self, session_id: str, question: str, answer: str, **kwargs) -> QAResponse:
         """创建标准响应格式"""
-        return {
-            "session_id": session_id,
-            "question": question,
-            "answer": answer,
-            "confidence": kwargs.get("confidence", 0.0),
-            "source": kwargs.get("source", "未知"),
-            "processing_time": kwargs.get("processing_time", 0.0)
-        }
+        return QAResponse(session_id, question, answer, **kwargs)
     
-    def get_session_history(self, session_id: str, limit: int = 10) -> List[Dict[str, Any]]:
+    async def get_session_history(self, session_id: str, limit: int = 10) -> List[Dict[str, Any]]:
         """
-        获取会话历史记录
+        获取会话历史记录，按问答轮次存储，读取时才展开为消息字典
         
         Args:
             session_id: 会话ID
@@ -280,13 +365,34 @@ class QAController:
         Returns:
             历史记录列表
         """
-        if session_id not in self.sessions:
+        session = await self._get_session(session_id)
+        if session is None:
             return []
             
-        history = self.sessions[session_id]["history"]
-        return history[-limit:] if limit > 0 else history
+        return self._expand_turns(session["history"], limit)
+    
+    @staticmethod
+    def _expand_turns(history, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        把按轮次存储的(问题, 回答, 时间戳)展开为消息字典列表
+        
+        Args:
+            history: 会话历史
+            limit: 返回的最大消息数，<=0时返回全部
+            
+        Returns:
+            {"role", "content", "timestamp"}消息列表
+        """
+        turns = list(history)
+        if limit > 0:
+            turns = turns[-((limit + 1) // 2):]
+        messages = []
+        for question, answer, timestamp in turns:
+            messages.append({"role": "user", "content": question, "timestamp": timestamp})
+            messages.append({"role": "assistant", "content": answer, "timestamp": timestamp})
+        return messages[-limit:] if limit > 0 else messages
     
-    def clear_session(self, session_id: str) -> bool:
+    async def clear_session(self, session_id: str) -> bool:
         """
         清除会话
         
@@ -296,7 +402,7 @@ class QAController:
         Returns:
             是否成功清除
         """
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            return True
-        return False 
\ No newline at end of file
+        removed = self.sessions.pop(session_id, None) is not None
+        if self.session_store:
+            removed = await self.session_store.delete(session_id) or removed
+        return removed 
\ No newline at end of file
@@ -6,6 +6,7 @@ from fastapi import APIRouter, Request, HTTPException, Depends
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from typing import Dict, List, Optional
+from functools import lru_cache
 import time
 import json
 
@@ -13,12 +14,24 @@ from ..api.session import SessionManager
 from ..models.mcp_engine import MCPEngine
 from ..services.data import DataProcessor
 
-# 初始化组件
+# 初始化组件，较重的组件在首次请求时才创建，之后各请求共享同一实例
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
-session_manager = SessionManager()
-mcp_engine = MCPEngine()
-data_processor = DataProcessor()
+
+@lru_cache
+def get_session_manager() -> SessionManager:
+    """获取会话管理器"""
+    return SessionManager()
+
+@lru_cache
+def get_mcp_engine() -> MCPEngine:
+    """获取MCP引擎"""
+    return MCPEngine()
+
+@lru_cache
+def get_data_processor() -> DataProcessor:
+    """获取文档处理器"""
+    return DataProcessor()
 
 # 页面路由
 @router.get("/", response_class=HTMLResponse)
@@ -39,25 +52,28 @@ async def dashboard(request: Request):
 
 # API路由
 @router.post("/api/query")
-async def process_query(query: str, session_id: str):
+async def process_query(query: str, session_id: str,
+                        session_manager: SessionManager = Depends(get_session_manager),
+                        mcp_engine: MCPEngine = Depends(get_mcp_engine)):
     """处理用户查询"""
     try:
         # 验证会话
-        if not session_manager.get_session(session_id):
+        if not await session_manager.get_session(session_id):
             raise HTTPException(status_code=400, detail="无效的会话ID")
         
         # 处理查询
         response = mcp_engine.process_query(query, session_id)
         
         # 更新会话历史
-        session_manager.update_session(session_id, query, response)
+        await session_manager.update_session(session_id, query, response)
         
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/api/upload")
-async def upload_document(file_path: str):
+async def upload_document(file_path: str,
+                          data_processor: DataProcessor = Depends(get_data_processor)):
     """上传并处理文档"""
     try:
         result = data_processor.process_document(file_path)
@@ -66,10 +82,11 @@ async def upload_document(file_path: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/api/session/{session_id}")
-async def get_session_history(session_id: str):
+async def get_session_history(session_id: str,
+                              session_manager: SessionManager = Depends(get_session_manager)):
     """获取会话历史"""
     try:
-        session = session_manager.get_session(session_id)
+        session = await session_manager.get_session(session_id)
         if not session:
             raise HTTPException(status_code=404, detail="会话不存在")
         return {"history": session.get('history', [])}
@@ -77,7 +94,7 @@ async def get_session_history(session_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/api/stats")
-async def get_stats():
+async def get_stats(session_manager: SessionManager = Depends(get_session_manager)):
     """获取系统统计信息"""
     try:
         # 获取活跃会话数
@@ -8,10 +8,31 @@
 import re
 import logging
 import time
-from typing import Dict, List, Tuple, Optional, Any, Union
+from typing import Dict, List, Tuple, Optional, Any, Union, AsyncIterator
+
+from app.utils.keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
+def _literal_anchor(pattern: str) -> Optional[str]:
+    """
+    取正则模式中必定出现的最长字面量片段，用于正则匹配前的快速预筛
+    
+    Args:
+        pattern: 只由字面量、字符类和.*组成的模式
+        
+    Returns:
+        字面量片段，无法确定时返回None(该模式总是执行正则匹配)
+    """
+    pieces = [piece for piece in re.split(r'\[[^\]]*\]|\.\*', pattern) if piece]
+    if not pieces:
+        return None
+    anchor = max(pieces, key=len)
+    # 含其他元字符或大小写字母时无法作为精确子串预筛
+    if re.search(r'[\\()|?+*{}.^$]', anchor) or anchor.lower() != anchor.upper():
+        return None
+    return anchor
+
 class QueryRouter:
     """查询路由器，管理多引擎查询策略"""
     
@@ -26,51 +47,92 @@ class QueryRouter:
         self.structured_kb = structured_kb
         self.semantic_rag = semantic_rag
         self.pattern_recognizer = self._build_patterns()
+        
+        # 每个模式的字面量锚点，问题中不含锚点的模式无需执行正则
+        self._pattern_anchors = {
+            type_name: [_literal_anchor(p.pattern) for p in patterns]
+            for type_name, patterns in self.pattern_recognizer.items()
+        }
+        self._anchor_matcher = KeywordMatcher(
+            (anchor, None)
+            for anchors in self._pattern_anchors.values()
+            for anchor in anchors if anchor
+        )
+        self._classify_fast = self._compile_classifier()
         logger.info("查询路由器初始化完成，已加载结构化查询和语义搜索引擎")
     
-    def _build_patterns(self) -> Dict[str, List[str]]:
-        """构建常见问题模式"""
-        return {
+    def _build_patterns(self) -> Dict[str, List[re.Pattern]]:
+        """构建常见问题模式，初始化时预编译，匹配时使用search，无需前导的.*"""
+        patterns = {
             "报名时间": [
-                r".*[什怎如]么时候.*报名",
-                r".*报名.*[时日截]期",
-                r".*报名.*开始",
-                r".*报名.*结束",
-                r".*[什怎如]么时候.*注册"
+                r"[什怎如]么时候.*报名",
+                r"报名.*[时日截]期",
+                r"报名.*开始",
+                r"报名.*结束",
+                r"[什怎如]么时候.*注册"
             ],
             "评分标准": [
-                r".*[如怎]何评[分判]",
-                r".*评分标准",
-                r".*评分规则",
-                r".*[如怎]何打分",
-                r".*成绩.*计算"
+                r"[如怎]何评[分判]",
+                r"评分标准",
+                r"评分规则",
+                r"[如怎]何打分",
+                r"成绩.*计算"
             ],
             "参赛要求": [
-                r".*参赛.*[要需]求",
-                r".*参赛.*条件",
-                r".*参赛.*资格",
-                r".*[谁哪]些人.*参[赛加]",
-                r".*[限面]向.*[谁哪]些"
+                r"参赛.*[要需]求",
+                r"参赛.*条件",
+                r"参赛.*资格",
+                r"[谁哪]些人.*参[赛加]",
+                r"[限面]向.*[谁哪]些"
             ],
             "竞赛简介": [
-                r".*[是为什]么[比赛竞]赛",
-                r".*介绍一下.*[比赛竞]赛",
-                r".*[简概]述.*[比赛竞]赛",
-                r".*了解.*[比赛竞]赛"
+                r"[是为什]么[比赛竞]赛",
+                r"介绍一下.*[比赛竞]赛",
+                r"[简概]述.*[比赛竞]赛",
+                r"了解.*[比赛竞]赛"
             ],
             "提交材料": [
-                r".*[需应要].*提交[什哪]些",
-                r".*提交.*[什哪]些",
-                r".*[需应要].*准备[什哪]些",
-                r".*[作提]品.*[要需形]求"
+                r"[需应要].*提交[什哪]些",
+                r"提交.*[什哪]些",
+                r"[需应要].*准备[什哪]些",
+                r"[作提]品.*[要需形]求"
             ],
             "奖项设置": [
-                r".*[有能会][获得].*[什哪]些奖",
-                r".*奖[金项].*[多有是]少",
-                r".*[获得]奖.*[福好处]",
-                r".*奖[项励].*设置"
+                r"[有能会][获得].*[什哪]些奖",
+                r"奖[金项].*[多有是]少",
+                r"[获得]奖.*[福好处]",
+                r"奖[项励].*设置"
             ]
         }
+        return {
+            type_name: [re.compile(p, re.IGNORECASE) for p in type_patterns]
+            for type_name, type_patterns in patterns.items()
+        }
+    
+    def _compile_classifier(self):
+        """
+        模式集合在运行期间不变，初始化时把逐类型、逐模式的匹配展开为一个函数，按顺序命中即返回
+        
+        Returns:
+            Callable[[str], Optional[str]]: 输入问题，返回信息类型或None
+        """
+        namespace = {"_anchor_matcher": self._anchor_matcher}
+        lines = [
+            "def _classify(question):",
+            "    present = {anchor for anchor, _ in _anchor_matcher.matches(question)}",
+        ]
+        index = 0
+        for type_name, patterns in self.pattern_recognizer.items():
+            for anchor, pattern in zip(self._pattern_anchors[type_name], patterns):
+                name = f"_P{index}"
+                namespace[name] = pattern
+                guard = f"{anchor!r} in present and " if anchor else ""
+                lines.append(f"    if {guard}{name}.search(question): return {type_name!r}")
+                index += 1
+        lines.append("    return None")
+        
+        exec(compile("\n".join(lines), "<query_router.classify>", "exec"), namespace)
+        return namespace["_classify"]
     
     def classify_question(self, question: str) -> Tuple[Optional[str], Optional[str]]:
         """
@@ -90,13 +152,7 @@ class QueryRouter:
         
         # 如果无法识别信息类型，尝试使用模式匹配
         if not info_type:
-            for type_name, patterns in self.pattern_recognizer.items():
-                for pattern in patterns:
-                    if re.match(pattern, question, re.IGNORECASE):
-                        info_type = type_name
-                        break
-                if info_type:
-                    break
+            info_type = self._classify_fast(question)
         
         logger.info(f"问题分类: '{question}' => 竞赛类型: {competition_type or '未知'}, 信息类型: {info_type or '未知'}")
         return competition_type, info_type
@@ -164,7 +220,39 @@ class QueryRouter:
         logger.info(f"使用语义搜索返回结果，置信度: {semantic_result.get('confidence', 'N/A')}")
         return semantic_result
     
-    def diagnose(self) -> Dict[str, Any]:
+    async def stream_query(self, question: str, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        流式路由查询：结构化知识库命中时一次性返回，否则流式返回语义搜索的回答
+        
+        Args:
+            question: 用户问题
+            session_id: 会话ID
+            
+        Yields:
+            str: 回答文本片段
+        """
+        competition_type, info_type = self.classify_question(question)
+        
+        if competition_type and info_type:
+            result = self.structured_kb.query(competition_type, info_type)
+            if result and result.get("confidence", 0) > 0.7:
+                logger.info(f"流式查询使用结构化结果，竞赛: {competition_type}, 信息类型: {info_type}")
+                yield result["answer"]
+                return
+        
+        async for token in self.semantic_rag.stream_query(question=question, session_id=session_id):
+            yield token
+    
+    async def rebuild_index(self) -> bool:
+        """
+        让语义搜索引擎重建其正在使用的索引
+        
+        Returns:
+            bool: 是否重建成功
+        """
+        return await self.semantic_rag.rebuild_index()
+    
+    async def diagnose(self) -> Dict[str, Any]:
         """返回查询路由器诊断信息"""
         result = {
             "structured_kb_status": "可用" if self.structured_kb else "未配置",
@@ -180,6 +268,6 @@ class QueryRouter:
         
         # 获取语义搜索引擎诊断信息
         if hasattr(self.semantic_rag, "diagnose"):
-            result["semantic_rag_info"] = self.semantic_rag.diagnose()
+            result["semantic_rag_info"] = await self.semantic_rag.diagnose()
         
         return result 
\ No newline at end of file
@@ -4,10 +4,15 @@
 """
 
 import re
+import asyncio
 import logging
+import functools
 import jieba
 import jieba.posseg as pseg
-from typing import List, Set, Dict, Any
+from types import MappingProxyType
+from typing import List, Set, Dict, Any, Tuple, FrozenSet, Mapping, Optional
+
+from app.utils.keyword_matcher import KeywordMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +35,17 @@ COMPETITION_SYNONYMS = {
     "材料": ["作品", "提交物", "文档", "代码", "submission"],
 }
 
+def _build_synonym_index() -> Dict[str, FrozenSet[str]]:
+    """构建同义词反查索引: 主词或任一同义词 -> 所在同义词组(含主词)的全部词语"""
+    index: Dict[str, FrozenSet[str]] = {}
+    for key, synonyms in COMPETITION_SYNONYMS.items():
+        group = frozenset([key, *synonyms])
+        for word in group:
+            index[word] = index.get(word, frozenset()) | group
+    return index
+
+_SYN_INDEX = _build_synonym_index()
+
 # 问题类型关键词
 QUESTION_TYPE_KEYWORDS = {
     "信息查询": ["什么是", "介绍", "简介", "说明", "定义", "概念"],
@@ -39,65 +55,80 @@ QUESTION_TYPE_KEYWORDS = {
     "奖项查询": ["奖项", "奖励", "奖金", "获奖", "荣誉", "几等奖"],
 }
 
+# 问题类型按定义顺序编号，匹配器的附加数据为(类型序号, 关键词位掩码)
+_QUESTION_TYPES = list(QUESTION_TYPE_KEYWORDS)
+_QUESTION_TYPE_SIZES = [len(QUESTION_TYPE_KEYWORDS[q_type]) for q_type in _QUESTION_TYPES]
+_QUESTION_TYPE_MATCHER = KeywordMatcher(
+    (keyword, (type_index, 1 << keyword_index))
+    for type_index, q_type in enumerate(_QUESTION_TYPES)
+    for keyword_index, keyword in enumerate(QUESTION_TYPE_KEYWORDS[q_type])
+)
+
+# 拒绝回答的表达，如"无法提供"、"资料中找不到"
+REJECT_PHRASES = [
+    "无法提供", "找不到", "没有相关信息", "无法回答",
+    "抱歉", "没有足够的信息", "不清楚", "不确定"
+]
+
+# 否定词加上"信息"、"资料"等词的组合
+REJECT_PATTERNS = [
+    r"没有.{0,3}(信息|资料|内容|数据)",
+    r"无法.{0,3}(回答|提供|查询|找到)",
+    r"不.{0,3}(清楚|确定|了解|明确)"
+]
+
+# 拒绝短语和拒绝模式合并为一个正则，一次扫描完成检测
+_REJECT_RE = re.compile("|".join([re.escape(p) for p in REJECT_PHRASES] + REJECT_PATTERNS))
+
 # 停用词列表
 STOPWORDS = {"的", "了", "是", "在", "我", "有", "和", "就", "不", "人", "都", "一", "一个", "上", "也", "很", "到", "说"}
 
-def extract_core_terms(question: str) -> List[str]:
+# 可以作为核心术语的单字关键字，以及实义词(名词、动词、形容词)的词性前缀
+KEY_SINGLE_CHARS = frozenset({"赛", "奖", "分", "题"})
+CONTENT_POS_PREFIXES = ('n', 'v', 'a')
+
+@functools.lru_cache(maxsize=4096)
+def extract_core_terms(question: str) -> Tuple[str, ...]:
     """
-    提取问题中的核心术语
+    提取问题中的核心术语，结果按问题缓存，重复问题无需再次分词
     
     Args:
         question: 用户问题
     
     Returns:
-        核心术语列表
-    """
-    # 使用jieba词性标注
-    words = pseg.cut(question)
-    
-    # 提取名词、动词等实义词
-    core_terms = []
-    for word, flag in words:
-        # 过滤停用词和单字词(除非是关键字如"赛"、"奖"等)
-        if word in STOPWORDS or (len(word) == 1 and word not in {"赛", "奖", "分", "题"}):
-            continue
-            
-        # 选择名词、动词、形容词等有实际意义的词
-        if flag.startswith(('n', 'v', 'a')) or len(word) > 1:
-            core_terms.append(word)
+        核心术语元组
+    """
+    # 使用jieba词性标注，过滤停用词；多字词全部保留，
+    # 单字词只保留"赛"、"奖"等关键字中属于名词、动词、形容词的
+    core_terms = [
+        word for word, flag in pseg.cut(question)
+        if word not in STOPWORDS
+        and (len(word) > 1 or (word in KEY_SINGLE_CHARS and flag.startswith(CONTENT_POS_PREFIXES)))
+    ]
     
     logger.info(f"从问题中提取的核心术语: {core_terms}")
-    return core_terms
+    return tuple(core_terms)
 
-def add_synonyms(terms: List[str]) -> Set[str]:
+@functools.lru_cache(maxsize=4096)
+def add_synonyms(terms: Tuple[str, ...]) -> FrozenSet[str]:
     """
     为核心术语添加同义词
     
     Args:
-        terms: 核心术语列表
+        terms: 核心术语元组
     
     Returns:
         扩展后的术语集合
     """
-    expanded = set(terms)
-    
-    for term in terms:
-        # 检查该术语是否有同义词
-        for key, synonyms in COMPETITION_SYNONYMS.items():
-            if term == key or term in synonyms:
-                # 添加所有同义词
-                expanded.update(synonyms)
-                expanded.add(key)  # 也添加主词
-    
-    # 移除原始术语，防止重复
-    for term in terms:
-        if term in expanded:
-            expanded.remove(term)
+    # 合并各术语所在同义词组(含主词)，再移除原始术语，防止重复
+    expanded = set().union(*(_SYN_INDEX.get(term, ()) for term in terms))
+    expanded.difference_update(terms)
     
     logger.info(f"术语同义词扩展: {terms} -> {expanded}")
-    return expanded
+    return frozenset(expanded)
 
-def identify_question_type(question: str) -> Dict[str, float]:
+@functools.lru_cache(maxsize=4096)
+def identify_question_type(question: str) -> Mapping[str, float]:
     """
     识别问题类型并计算匹配度
     
@@ -105,20 +136,21 @@ def identify_question_type(question: str) -> Dict[str, float]:
         question: 用户问题
     
     Returns:
-        问题类型及其匹配度字典
+        问题类型及其匹配度的只读映射(结果被缓存共享，需要修改时请先复制)
     """
     question = question.lower()
     type_scores = {}
     
-    # 计算每种问题类型的匹配度
-    for q_type, keywords in QUESTION_TYPE_KEYWORDS.items():
-        count = 0
-        for keyword in keywords:
-            if keyword in question:
-                count += 1
-        
-        if count > 0:
-            score = count / len(keywords) * 0.7 + 0.3  # 基础分0.3，最高分1.0
+    # 一次扫描，用位掩码记录各问题类型命中了哪些关键词
+    hits = [0] * len(_QUESTION_TYPES)
+    for _, (type_index, bit) in _QUESTION_TYPE_MATCHER.matches(question):
+        hits[type_index] |= bit
+    
+    # 计算每种问题类型的匹配度，按类型定义顺序输出
+    for type_index, mask in enumerate(hits):
+        if mask:
+            q_type = _QUESTION_TYPES[type_index]
+            score = mask.bit_count() / _QUESTION_TYPE_SIZES[type_index] * 0.7 + 0.3  # 基础分0.3，最高分1.0
             type_scores[q_type] = min(score, 1.0)
     
     # 如果没有匹配任何类型，设为通用问题
@@ -126,8 +158,9 @@ def identify_question_type(question: str) -> Dict[str, float]:
         type_scores["通用问题"] = 0.5
     
     logger.info(f"问题类型分析: {type_scores}")
-    return type_scores
+    return MappingProxyType(type_scores)
 
+@functools.lru_cache(maxsize=4096)
 def enhance_question(question: str) -> str:
     """
     增强问题文本，提高检索质量
@@ -174,6 +207,89 @@ def enhance_question(question: str) -> str:
     logger.info(f"问题增强: 原始问题=[{question}], 增强后=[{enhanced_question}]")
     return enhanced_question
 
+class _EnhanceBatcher:
+    """
+    问题增强批处理器
+    空闲时立即在线程中处理；已有批次在处理时，新到达的问题先排队，
+    上一批完成后合并为一次线程调用，相同问题只处理一次
+    排队的问题和批次任务都属于创建它们的事件循环，换用新循环时丢弃旧状态
+    """
+    
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._task: Optional[asyncio.Task] = None
+    
+    async def enhance(self, question: str) -> str:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # 旧循环已关闭(如热重载或测试中重建应用)时，其批次任务不会再完成，不能继续等待
+            self._loop, self._pending, self._task = loop, {}, None
+        future = loop.create_future()
+        self._pending.setdefault(question, []).append(future)
+        if self._task is None or self._task.done():
+            self._start()
+        return await future
+    
+    def _start(self):
+        batch, self._pending = self._pending, {}
+        self._task = asyncio.create_task(self._run(batch))
+    
+    async def _run(self, batch: Dict[str, List[asyncio.Future]]):
+        try:
+            results = await asyncio.to_thread(self._enhance_all, list(batch))
+            for question, result in zip(batch, results):
+                for future in batch[question]:
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        except BaseException as e:
+            # 线程调用失败或批次被取消时，同批所有等待者都要得到结果，否则会一直挂起；
+            # 取消也转换为普通异常，调用方可以照常退回原问题
+            error = e if isinstance(e, Exception) else RuntimeError("问题增强批次被取消")
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(error)
+            # 普通异常已交给等待者处理，只有取消需要继续向上传播
+            if error is not e:
+                raise
+        finally:
+            # 状态已被新的事件循环重置时，排队的问题由新循环自己处理
+            if self._pending and self._task is asyncio.current_task():
+                self._start()
+    
+    @staticmethod
+    def _enhance_all(questions: List[str]) -> List[Any]:
+        """在工作线程中逐个增强问题，单个问题出错不影响同批其他问题"""
+        results = []
+        for question in questions:
+            try:
+                results.append(enhance_question(question))
+            except Exception as e:
+                results.append(e)
+        return results
+
+_batcher = _EnhanceBatcher()
+
+# 调用方等待问题增强的最长时间(秒)，超时后退回原问题
+ENHANCE_TIMEOUT = 5.0
+
+async def enhance_question_async(question: str) -> str:
+    """
+    在工作线程中增强问题，不阻塞事件循环；并发到达的问题合并为一批处理
+    
+    Args:
+        question: 用户问题
+    
+    Returns:
+        增强后的问题
+    """
+    return await _batcher.enhance(question)
+
 def is_low_quality_answer(answer: str) -> bool:
     """
     检测回答是否为低质量
@@ -184,34 +300,8 @@ def is_low_quality_answer(answer: str) -> bool:
     Returns:
         是否为低质量回答
     """
-    # 检查是否包含"无法提供"、"资料中找不到"等拒绝回答的表达
-    reject_phrases = [
-        "无法提供", "找不到", "没有相关信息", "无法回答", 
-        "抱歉", "没有足够的信息", "不清楚", "不确定"
-    ]
-    
-    # 检查否定词加上"信息"、"资料"等词的组合
-    reject_patterns = [
-        r"没有.{0,3}(信息|资料|内容|数据)",
-        r"无法.{0,3}(回答|提供|查询|找到)",
-        r"不.{0,3}(清楚|确定|了解|明确)"
-    ]
-    
-    # 1. 检查短回答
-    if len(answer) < 15:
-        return True
-    
-    # 2. 检查拒绝回答的短语
-    for phrase in reject_phrases:
-        if phrase in answer:
-            return True
-    
-    # 3. 检查拒绝模式
-    for pattern in reject_patterns:
-        if re.search(pattern, answer):
-            return True
-    
-    return False
+    # 1. 检查短回答；2. 检查拒绝回答的短语和模式
+    return len(answer) < 15 or _REJECT_RE.search(answer) is not None
 
 async def generate_backup_answer(question: str) -> str:
     """
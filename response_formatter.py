@@ -3,134 +3,196 @@
 确保所有API和WebSocket响应格式一致
 """
 
+import re
 import time
+import uuid
+import asyncio
 import logging
-from typing import Dict, Any, Optional, Union
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, TypedDict, Union
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_ERROR_MESSAGE = "抱歉，处理您的问题时出现错误，请稍后再试。"
+
+# 常见错误类型对应的用户友好提示，按错误信息中出现的关键词选择
+ERROR_MESSAGES = {
+    "timeout": "处理您的问题时间过长，请尝试简化问题或稍后再试。",
+    "connection": "系统连接出现问题，请刷新页面后再试。",
+    "memory": "系统资源不足，请稍后再试。"
+}
+_ERR_RE = re.compile("|".join(f"(?P<{name}>{name})" for name in ERROR_MESSAGES), re.IGNORECASE)
+
+class StdResponse(TypedDict, total=False):
+    """标准化响应序列化后的字段，原始响应中的其他字段原样保留"""
+    answer: str
+    confidence: float
+    has_answer: bool
+    processing_time: float
+    timestamp: float
+    session_id: str
+    error: str
+    is_error: bool
+
+@dataclass(slots=True)
+class StandardResponse:
+    """标准化响应，使用__slots__减少每次响应的对象开销，发送前再转换为字典"""
+    answer: str
+    confidence: float = 0.5
+    has_answer: bool = False
+    processing_time: float = 0.0
+    timestamp: float = 0.0
+    session_id: str = ""
+    error: Optional[str] = None
+    is_error: bool = False
+    extra: Dict[str, Any] = field(default_factory=dict)  # 原始响应中的其他字段
+    
+    def to_dict(self) -> StdResponse:
+        """转换为字典，便于序列化为JSON，error和is_error只在设置时输出"""
+        data: StdResponse = {
+            **self.extra,
+            "answer": self.answer,
+            "confidence": self.confidence,
+            "has_answer": self.has_answer,
+            "processing_time": self.processing_time,
+            "timestamp": self.timestamp,
+            "session_id": self.session_id
+        }
+        if self.error is not None:
+            data["error"] = self.error
+        if self.is_error:
+            data["is_error"] = True
+        return data
+
+def _has_content(text: str) -> bool:
+    """判断文本是否含有非空白字符，不像strip()那样复制字符串"""
+    return bool(text) and not text.isspace()
+
+def _elapsed_since(start_time: float) -> float:
+    """
+    计算自start_time以来的耗时
+    
+    start_time取自事件循环的单调时钟(loop.time())，不在事件循环中时退回time.monotonic()
+    """
+    try:
+        now = asyncio.get_running_loop().time()
+    except RuntimeError:
+        now = time.monotonic()
+    return now - start_time
+
 def standardize_response(result: Union[Dict[str, Any], str, None], 
                          session_id: Optional[str] = None,
-                         start_time: Optional[float] = None) -> Dict[str, Any]:
+                         start_time: Optional[float] = None) -> StandardResponse:
     """
     标准化响应格式，确保所有输出格式一致
     
     Args:
         result: 原始响应，可能是字典、字符串或None
         session_id: 会话ID
-        start_time: 处理开始时间，用于计算处理耗时
+        start_time: 处理开始时间(事件循环单调时钟)，用于计算处理耗时
         
     Returns:
-        标准化的响应字典
+        标准化的响应，发送前调用to_dict()
     """
-    # 计算处理时间
+    # 计算处理时间，时间戳在整个响应中只取一次
+    now = time.time()
     processing_time = 0
     if start_time:
-        processing_time = time.time() - start_time
+        processing_time = _elapsed_since(start_time)
     
     # 处理None结果
     if result is None:
         logger.warning("收到空响应，转换为标准格式")
-        return {
-            "answer": "无法回答此问题",
-            "confidence": 0.0,
-            "has_answer": False,
-            "processing_time": processing_time,
-            "timestamp": time.time(),
-            "session_id": session_id or f"session_{int(time.time())}"
-        }
+        return StandardResponse(
+            answer="无法回答此问题",
+            confidence=0.0,
+            has_answer=False,
+            processing_time=processing_time,
+            timestamp=now,
+            session_id=session_id or uuid.uuid4().hex
+        )
     
     # 处理字符串结果
     if isinstance(result, str):
         logger.info("将字符串响应转换为标准格式")
-        return {
-            "answer": result,
-            "confidence": 0.5,  # 默认中等置信度
-            "has_answer": bool(result.strip()),
-            "processing_time": processing_time,
-            "timestamp": time.time(),
-            "session_id": session_id or f"session_{int(time.time())}"
-        }
+        return StandardResponse(
+            answer=result,
+            confidence=0.5,  # 默认中等置信度
+            has_answer=_has_content(result),
+            processing_time=processing_time,
+            timestamp=now,
+            session_id=session_id or uuid.uuid4().hex
+        )
     
-    # 处理字典结果，确保包含所有需要的字段
+    # 处理字典结果，原始响应中已有的字段优先，缺失的用默认值补齐，其余字段原样保留
     if isinstance(result, dict):
-        # 确保关键字段存在
-        if "answer" not in result:
+        extra = dict(result)
+        if "answer" in extra:
+            answer = extra.pop("answer")
+        elif "response" in extra:
             # 尝试从response字段获取答案
-            if "response" in result:
-                result["answer"] = result["response"]
-            else:
-                result["answer"] = "无法回答此问题"
-                logger.warning("响应字典缺少answer字段，已添加默认值")
-        
-        # 添加其他必要字段
-        if "confidence" not in result:
-            result["confidence"] = 0.5
-        
-        if "has_answer" not in result:
-            result["has_answer"] = bool(result["answer"].strip())
+            answer = extra["response"]
+        else:
+            answer = "无法回答此问题"
+            logger.warning("响应字典缺少answer字段，已添加默认值")
         
-        if "processing_time" not in result and start_time:
-            result["processing_time"] = processing_time
-        
-        if "timestamp" not in result:
-            result["timestamp"] = time.time()
-        
-        if "session_id" not in result and session_id:
-            result["session_id"] = session_id
-        elif "session_id" not in result:
-            result["session_id"] = f"session_{int(time.time())}"
-        
-        return result
+        has_answer = extra.pop("has_answer") if "has_answer" in extra else _has_content(answer)
+        result_session_id = extra.pop("session_id") if "session_id" in extra else (session_id or uuid.uuid4().hex)
+        return StandardResponse(
+            answer=answer,
+            confidence=extra.pop("confidence", 0.5),
+            has_answer=has_answer,
+            processing_time=extra.pop("processing_time", processing_time),
+            timestamp=extra.pop("timestamp", now),
+            session_id=result_session_id,
+            error=extra.pop("error", None),
+            is_error=extra.pop("is_error", False),
+            extra=extra
+        )
     
     # 处理其他类型的结果
     logger.warning(f"收到非预期类型的响应: {type(result)}")
-    return {
-        "answer": str(result),
-        "confidence": 0.3,
-        "has_answer": True,
-        "processing_time": processing_time,
-        "timestamp": time.time(),
-        "session_id": session_id or f"session_{int(time.time())}"
-    }
+    return StandardResponse(
+        answer=str(result),
+        confidence=0.3,
+        has_answer=True,
+        processing_time=processing_time,
+        timestamp=now,
+        session_id=session_id or uuid.uuid4().hex
+    )
 
 def format_error_response(error: Exception, 
                           session_id: Optional[str] = None,
-                          start_time: Optional[float] = None) -> Dict[str, Any]:
+                          start_time: Optional[float] = None) -> StandardResponse:
     """
     格式化错误响应
     
     Args:
         error: 异常对象
         session_id: 会话ID
-        start_time: 处理开始时间
+        start_time: 处理开始时间(事件循环单调时钟)
         
     Returns:
-        标准化的错误响应
+        标准化的错误响应，发送前调用to_dict()
     """
+    now = time.time()
     processing_time = 0
     if start_time:
-        processing_time = time.time() - start_time
+        processing_time = _elapsed_since(start_time)
     
     error_message = str(error)
     
     # 对常见错误类型进行用户友好的提示
-    user_friendly_message = "抱歉，处理您的问题时出现错误，请稍后再试。"
-    
-    if "timeout" in error_message.lower():
-        user_friendly_message = "处理您的问题时间过长，请尝试简化问题或稍后再试。"
-    elif "connection" in error_message.lower():
-        user_friendly_message = "系统连接出现问题，请刷新页面后再试。"
-    elif "memory" in error_message.lower():
-        user_friendly_message = "系统资源不足，请稍后再试。"
+    match = _ERR_RE.search(error_message)
+    user_friendly_message = ERROR_MESSAGES[match.lastgroup] if match else DEFAULT_ERROR_MESSAGE
     
-    return {
-        "answer": user_friendly_message,
-        "error": error_message,
-        "confidence": 0.0,
-        "has_answer": False,
-        "is_error": True,
-        "processing_time": processing_time,
-        "timestamp": time.time(),
-        "session_id": session_id or f"session_{int(time.time())}"
-    } 
\ No newline at end of file
+    return StandardResponse(
+        answer=user_friendly_message,
+        confidence=0.0,
+        has_answer=False,
+        processing_time=processing_time,
+        timestamp=now,
+        session_id=session_id or uuid.uuid4().hex,
+        error=error_message,
+        is_error=True
+    ) 
\ No newline at end of file
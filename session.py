@@ -1,59 +1,184 @@
 """
 会话管理模块
 """
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
+import logging
 import time
 import uuid
+from collections import OrderedDict
+
+import orjson
+
+try:
+    from redis import asyncio as redis
+except ImportError:
+    # 未安装redis时会话只保存在进程内
+    redis = None
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+class RedisSessionStore:
+    """
+    基于Redis的会话存储，多个工作进程共享会话，由Redis的EXPIRE负责过期淘汰
+    使用redis.asyncio客户端，读写不阻塞事件循环
+    会话信息存为哈希session:{id}，历史记录存为列表session:{id}:history
+    """
+    def __init__(self, url: str, ttl: int = 3600, max_history: int = 50):
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+        self.max_history = max_history
+        
+    @classmethod
+    def from_settings(cls) -> Optional["RedisSessionStore"]:
+        """
+        按配置创建会话存储，未配置REDIS_URL或未安装redis时返回None
+        """
+        if not settings.REDIS_URL:
+            return None
+        if redis is None:
+            logger.warning("已配置REDIS_URL但未安装redis，会话只保存在进程内")
+            return None
+        return cls(settings.REDIS_URL, settings.SESSION_TTL, settings.MAX_SESSION_HISTORY)
+        
+    @staticmethod
+    def _keys(session_id: str):
+        key = f"session:{session_id}"
+        return key, f"{key}:history"
+        
+    async def create(self, session_id: str, info: Dict[str, Any]):
+        """
+        保存会话信息并设置过期时间
+        """
+        key, _ = self._keys(session_id)
+        mapping = {k: "" if v is None else v for k, v in info.items() if k != "history"}
+        pipe = self.client.pipeline()
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+        
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取会话信息，不存在或已过期时返回None
+        """
+        key, _ = self._keys(session_id)
+        info = await self.client.hgetall(key)
+        return info or None
+        
+    async def append_history(self, session_id: str, entry: Any):
+        """
+        追加一条历史记录(可JSON序列化的字典或元组)，只保留最近max_history条，并刷新过期时间
+        """
+        key, history_key = self._keys(session_id)
+        pipe = self.client.pipeline()
+        pipe.rpush(history_key, orjson.dumps(entry))
+        pipe.ltrim(history_key, -self.max_history, -1)
+        pipe.expire(history_key, self.ttl)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+        
+    async def get_history(self, session_id: str, limit: int = 0) -> List[Any]:
+        """
+        获取最近limit条历史记录，limit<=0时返回全部
+        """
+        _, history_key = self._keys(session_id)
+        start = -limit if limit > 0 else 0
+        return [orjson.loads(item) for item in await self.client.lrange(history_key, start, -1)]
+        
+    async def delete(self, session_id: str) -> bool:
+        """
+        删除会话及其历史记录，返回会话是否存在
+        """
+        return await self.client.delete(*self._keys(session_id)) > 0
 
 class SessionManager:
     """
     会话管理器
+    配置了Redis时以Redis为准，进程内字典只作为热点会话的本地缓存
+    本地会话按最近活跃时间排序，最久未活跃的在最前，清理时只需从头部弹出过期会话
+    每次加入本地会话时顺带清理过期会话，并把数量限制在MAX_SESSIONS以内
     """
-    def __init__(self):
-        self.sessions: Dict[str, Dict] = {}
+    def __init__(self, store: Optional[RedisSessionStore] = None):
+        self.sessions: OrderedDict[str, Dict] = OrderedDict()
+        self.store = store or RedisSessionStore.from_settings()
+        
+    def _add_local(self, session_id: str, session: Dict):
+        """
+        加入本地会话，先清理过期会话，超过MAX_SESSIONS时淘汰最久未活跃的会话
+        """
+        self.cleanup_inactive_sessions(settings.SESSION_TTL)
+        self.sessions[session_id] = session
+        while len(self.sessions) > settings.MAX_SESSIONS:
+            self.sessions.popitem(last=False)
         
-    def create_session(self) -> str:
+    async def create_session(self) -> str:
         """
         创建新会话
         """
-        session_id = str(uuid.uuid4())
-        self.sessions[session_id] = {
-            'created_at': time.time(),
-            'last_active': time.time(),
-            'history': []
-        }
+        session_id = uuid.uuid4().hex
+        now = time.time()
+        session = {'created_at': now, 'last_active': now, 'history': []}
+        self._add_local(session_id, session)
+        if self.store:
+            await self.store.create(session_id, session)
         return session_id
         
-    def get_session(self, session_id: str) -> Optional[Dict]:
+    async def get_session(self, session_id: str) -> Optional[Dict]:
         """
-        获取会话信息
+        获取会话信息，本地没有时从Redis加载
         """
-        return self.sessions.get(session_id)
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session['last_active'] = time.time()
+            self.sessions.move_to_end(session_id)
+        elif self.store:
+            info = await self.store.get(session_id)
+            if info is not None:
+                history = await self.store.get_history(session_id)
+                # 等待Redis期间其他请求可能已加载同一会话，以先加载的为准
+                session = self.sessions.get(session_id)
+                if session is None:
+                    session = {
+                        'created_at': float(info.get('created_at') or time.time()),
+                        'last_active': time.time(),
+                        'history': history
+                    }
+                    self._add_local(session_id, session)
+        return session
         
-    def update_session(self, session_id: str, query: str, response: Dict):
+    async def update_session(self, session_id: str, query: str, response: Dict):
         """
         更新会话历史
         """
-        if session_id in self.sessions:
-            self.sessions[session_id]['last_active'] = time.time()
-            self.sessions[session_id]['history'].append({
+        session = await self.get_session(session_id)
+        if session is not None:
+            session['last_active'] = time.time()
+            self.sessions.move_to_end(session_id)
+            entry = {
                 'query': query,
                 'response': response,
                 'timestamp': time.time()
-            })
+            }
+            session['history'].append(entry)
+            if self.store:
+                await self.store.append_history(session_id, entry)
             
-    def delete_session(self, session_id: str):
+    async def delete_session(self, session_id: str):
         """
         删除会话
         """
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        self.sessions.pop(session_id, None)
+        if self.store:
+            await self.store.delete(session_id)
             
     def cleanup_inactive_sessions(self, max_age: int = 3600):
         """
-        清理不活跃的会话
+        清理不活跃的会话，遇到第一个未过期的会话即停止
         """
-        current_time = time.time()
-        for session_id, session in list(self.sessions.items()):
-            if current_time - session['last_active'] > max_age:
-                del self.sessions[session_id]
\ No newline at end of file
+        cutoff = time.time() - max_age
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session['last_active'] >= cutoff:
+                break
+            self.sessions.popitem(last=False)
\ No newline at end of file
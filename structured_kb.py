@@ -6,15 +6,30 @@
 """
 
 import os
+import sys
 import json
 import re
 import logging
 import glob
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
-import jieba
-import jieba.posseg as pseg
 from tqdm import tqdm
-from typing import Dict, List, Set, Tuple, Optional, Any
+from typing import Dict, Iterator, List, Set, Tuple, Optional, Any
+
+try:
+    import orjson
+except ImportError:
+    # 未安装orjson时使用标准库json读写知识库文件
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    # 未安装msgpack时只读写JSON格式的知识库
+    msgpack = None
+
+from app.utils.keyword_matcher import KeywordMatcher
 
 # 配置日志
 logging.basicConfig(
@@ -23,9 +38,141 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 信息类型对应的段落标题模式，标题之后到换行为止的内容即该类型的信息
+INFO_HEADER_PATTERNS = {
+    "报名时间": r"报名时间",
+    "评分标准": r"评[分价][标规则]准",
+    "参赛要求": r"参赛[要条件][求件]",
+    "竞赛简介": r"[竞比赛][赛事]简介",
+    "提交材料": r"提交[材要][料求]",
+    "奖项设置": r"奖[项励][设内]置",
+    "赛程安排": r"[赛比][程赛]安排",
+    "联系方式": r"联系方式"
+}
+
+# 所有信息类型合并为一个正则，一次扫描文档即可提取全部信息，命名分组对应信息类型
+# 分组首尾限定为非空白字符，行内空白留在分组外，提取结果无需再strip
+_INFO_GROUPS = {f"info{index}": info_type for index, info_type in enumerate(INFO_HEADER_PATTERNS)}
+_COMBINED_INFO_PATTERN = re.compile(
+    "|".join(
+        rf"{INFO_HEADER_PATTERNS[info_type]}[:：]?[^\S\n]*(?P<{group}>(?:\S(?:.*?\S)??)?)[^\S\n]*(?=\n\n|\n[^\n]|$)"
+        for group, info_type in _INFO_GROUPS.items()
+    ),
+    re.DOTALL
+)
+
+def _best_match(matcher: KeywordMatcher, text: str) -> Optional[str]:
+    """返回匹配器在文本中排序键最小的命中目标，附加数据为(排序键, 目标)"""
+    best_key = None
+    best = None
+    for _, (key, target) in matcher.matches(text):
+        if best_key is None or key < best_key:
+            best_key, best = key, target
+    return best
+
+def _build_filename_matcher(aliases: Dict[str, str]) -> KeywordMatcher:
+    """
+    构建从文件名识别竞赛类型的匹配器，完整竞赛名称优先于别名，同级按别名表顺序
+    
+    Args:
+        aliases: 竞赛别名映射
+        
+    Returns:
+        KeywordMatcher: 附加数据为(排序键, 竞赛类型)
+    """
+    entries = []
+    for index, comp_type in enumerate(aliases.values()):
+        entries.append((comp_type, ((0, index), comp_type)))
+    for index, (alias, comp_type) in enumerate(aliases.items()):
+        entries.append((alias, ((1, index), comp_type)))
+    return KeywordMatcher(entries)
+
+def _extract_structured_info(content: str) -> Dict[str, str]:
+    """从文本中提取结构化信息"""
+    result = {}
+    
+    # 单次扫描提取全部信息，同一类型出现多次时保留第一处；
+    # 每次从字段值开头继续扫描，同一行后面的其他字段标题(如"报名时间：… 联系方式：…")也能被提取
+    pos = 0
+    while len(result) < len(INFO_HEADER_PATTERNS):
+        match = _COMBINED_INFO_PATTERN.search(content, pos)
+        if match is None:
+            break
+        group = match.lastgroup
+        result.setdefault(_INFO_GROUPS[group], match.group(group))
+        pos = match.start(group)
+    
+    # 如果没有找到竞赛简介，尝试从开头提取
+    if "竞赛简介" not in result:
+        intro = content.split("\n\n", 1)[0].strip()
+        if len(intro) > 50:  # 只有足够长的文本才视为简介
+            result["竞赛简介"] = intro
+    
+    return result
+
+def _iter_txt(path: str) -> Iterator[str]:
+    """
+    递归遍历目录下的txt文件，DirEntry自带文件类型信息，无需额外stat
+    与os.walk一致：目录不存在时不返回任何文件，无法读取的目录跳过，不进入目录符号链接，但包含文件符号链接
+    """
+    if not os.path.isdir(path):
+        logger.warning(f"文档目录 {path} 不存在")
+        return
+    yield from _scan_txt(path)
+
+def _scan_txt(path: str) -> Iterator[str]:
+    """_iter_txt的递归实现"""
+    try:
+        it = os.scandir(path)
+    except OSError as e:
+        logger.warning(f"无法读取目录 {path}: {e}")
+        return
+    with it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            if is_dir:
+                yield from _scan_txt(entry.path)
+            elif entry.name.endswith(".txt") and entry.is_file():
+                yield entry.path
+
+def _extract_file(file_path: str, filename_matcher: KeywordMatcher) -> Tuple[Optional[str], Dict[str, str]]:
+    """
+    处理单个文件，提取结构化信息，只依赖参数以便在子进程中执行
+    
+    Args:
+        file_path: 文档路径
+        filename_matcher: 从文件名识别竞赛类型的匹配器
+        
+    Returns:
+        Tuple: (竞赛类型, 信息字典)，无法识别竞赛类型或处理失败时竞赛类型为None
+    """
+    try:
+        # 从文件名中提取竞赛类型
+        file_name = os.path.basename(file_path)
+        competition_type = _best_match(filename_matcher, file_name)
+        
+        if not competition_type:
+            logger.warning(f"无法识别文件 {file_name} 的竞赛类型，跳过")
+            return None, {}
+        
+        # 读取文件内容并提取结构化信息
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return competition_type, _extract_structured_info(content)
+        
+    except Exception as e:
+        logger.error(f"处理文件 {file_path} 失败: {e}")
+        return None, {}
+
 class StructuredCompetitionKB:
     """结构化竞赛知识库，提供精确信息检索"""
     
+    # 文档数达到该值时才用多进程解析，文档较少时进程启动和导入的开销远大于解析本身
+    PARALLEL_MIN_FILES = 64
+    
     def __init__(self, docs_path: str, rebuild: bool = False):
         """
         初始化结构化竞赛知识库
@@ -36,8 +183,13 @@ class StructuredCompetitionKB:
         """
         self.docs_path = docs_path
         self.kb_file = Path("data/kb/structured_kb.json")
+        # 二进制副本，启动时优先加载；JSON保留为可读版本
+        self.kb_binary_file = self.kb_file.with_suffix(".msgpack")
+        # 竞赛名称的分词结果，热启动时直接读取，无需加载jieba
+        self.keywords_file = self.kb_file.with_name("competition_keywords.json")
         self.kb: Dict[str, Dict[str, str]] = {}  # 结构化知识库
         self.competition_aliases: Dict[str, str] = self._build_competition_aliases()
+        self._filename_matcher = _build_filename_matcher(self.competition_aliases)
         self.info_types: Dict[str, List[str]] = self._build_info_type_map()
         
         # 初始化知识库
@@ -45,6 +197,7 @@ class StructuredCompetitionKB:
             self._load_kb()
         else:
             self._build_kb()
+        self._intern_kb()
             
         # 记录统计信息
         self.competition_types = set(self.kb.keys())
@@ -94,16 +247,39 @@ class StructuredCompetitionKB:
             "联系方式": ["联系方式", "联系人", "咨询方式", "联系电话", "联系邮箱", "联系微信", "比赛咨询", "赛事咨询"]
         }
     
+    def _intern_kb(self):
+        """
+        驻留竞赛类型和信息类型字符串，所有竞赛共用同一份信息类型键，查询时字典比较可直接按指针命中
+        """
+        self.kb = {
+            sys.intern(comp_type): {sys.intern(info_type): text for info_type, text in info.items()}
+            for comp_type, info in self.kb.items()
+        }
+        self.info_types = {sys.intern(info_type): keywords for info_type, keywords in self.info_types.items()}
+    
     def _load_kb(self):
-        """从文件加载知识库"""
+        """从文件加载知识库，二进制副本不旧于JSON时优先加载二进制副本"""
         try:
-            with open(self.kb_file, 'r', encoding='utf-8') as f:
-                self.kb = json.load(f)
+            if self._binary_kb_usable():
+                self.kb = msgpack.unpackb(self.kb_binary_file.read_bytes(), raw=False)
+                logger.info(f"从 {self.kb_binary_file} 加载结构化知识库成功")
+                return
+            if orjson is not None:
+                self.kb = orjson.loads(self.kb_file.read_bytes())
+            else:
+                with open(self.kb_file, 'r', encoding='utf-8') as f:
+                    self.kb = json.load(f)
             logger.info(f"从 {self.kb_file} 加载结构化知识库成功")
         except Exception as e:
             logger.error(f"加载结构化知识库失败: {e}")
             self._build_kb()  # 加载失败则重建
     
+    def _binary_kb_usable(self) -> bool:
+        """二进制副本存在且不早于JSON文件时可用，手工修改过JSON后以JSON为准"""
+        if msgpack is None or not self.kb_binary_file.exists():
+            return False
+        return self.kb_binary_file.stat().st_mtime >= self.kb_file.stat().st_mtime
+    
     def _build_kb(self):
         """构建结构化知识库"""
         logger.info("开始构建结构化知识库...")
@@ -112,144 +288,137 @@ class StructuredCompetitionKB:
         os.makedirs(os.path.dirname(self.kb_file), exist_ok=True)
         
         # 扫描所有txt文件
-        txt_files = []
-        for root, dirs, files in os.walk(self.docs_path):
-            for file in files:
-                if file.endswith(".txt"):
-                    txt_files.append(os.path.join(root, file))
+        txt_files = list(_iter_txt(self.docs_path))
         
-        # 解析每个文件提取结构化知识
-        for txt_file in tqdm(txt_files, desc="处理竞赛文档"):
-            self._process_file(txt_file)
+        # 解析文档只做正则和字符串处理，文档较多时分发到多个进程并行执行，按文件顺序合并结果
+        extract = partial(_extract_file, filename_matcher=self._filename_matcher)
+        if len(txt_files) < self.PARALLEL_MIN_FILES:
+            self._merge_extracted(map(extract, txt_files), len(txt_files))
+        else:
+            with ProcessPoolExecutor() as executor:
+                self._merge_extracted(executor.map(extract, txt_files, chunksize=8), len(txt_files))
         
         # 保存知识库
-        with open(self.kb_file, 'w', encoding='utf-8') as f:
-            json.dump(self.kb, f, ensure_ascii=False, indent=2)
+        if orjson is not None:
+            self.kb_file.write_bytes(orjson.dumps(self.kb, option=orjson.OPT_INDENT_2))
+        else:
+            with open(self.kb_file, 'w', encoding='utf-8') as f:
+                json.dump(self.kb, f, ensure_ascii=False, indent=2)
+        if msgpack is not None:
+            self.kb_binary_file.write_bytes(msgpack.packb(self.kb, use_bin_type=True))
         
         logger.info(f"结构化知识库构建完成，保存至 {self.kb_file}")
     
-    def _process_file(self, file_path: str):
-        """处理单个文件，提取结构化信息"""
-        try:
-            # 从文件名中提取竞赛类型
-            file_name = os.path.basename(file_path)
-            competition_type = self._extract_competition_type(file_name)
-            
-            if not competition_type:
-                logger.warning(f"无法识别文件 {file_name} 的竞赛类型，跳过")
-                return
-            
-            # 读取文件内容
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # 提取结构化信息
-            info_dict = self._extract_structured_info(content)
-            
-            # 更新知识库
-            if competition_type not in self.kb:
-                self.kb[competition_type] = {}
-            
-            self.kb[competition_type].update(info_dict)
-            
-        except Exception as e:
-            logger.error(f"处理文件 {file_path} 失败: {e}")
+    def _merge_extracted(self, results, total: int):
+        """按文件顺序把(竞赛类型, 信息字典)合并进知识库"""
+        for competition_type, info_dict in tqdm(results, total=total, desc="处理竞赛文档"):
+            if competition_type:
+                self.kb.setdefault(competition_type, {}).update(info_dict)
     
-    def _extract_competition_type(self, file_name: str) -> Optional[str]:
-        """从文件名中提取竞赛类型"""
-        # 尝试从文件名中直接匹配完整竞赛名称
-        for comp_type in self.competition_aliases.values():
-            if comp_type in file_name:
-                return comp_type
-        
-        # 尝试从文件名中匹配别名
-        for alias, comp_type in self.competition_aliases.items():
-            if alias in file_name:
-                return comp_type
+    def _load_competition_keywords(self):
+        """加载竞赛关键词匹配表，优先读取保存的分词结果，竞赛类型有变化时重新分词"""
+        saved = self._read_saved_keywords()
+        if saved is not None:
+            self.competition_keywords = saved
+        else:
+            self.competition_keywords = self._tokenize_competition_names()
         
-        return None
+        self._build_matchers()
     
-    def _extract_structured_info(self, content: str) -> Dict[str, str]:
-        """从文本中提取结构化信息"""
-        result = {}
-        
-        # 定义信息提取模式
-        patterns = {
-            "报名时间": r"报名时间[:：]?(.*?)(?=\n\n|\n[^\n]|$)",
-            "评分标准": r"评[分价][标规则]准[:：]?(.*?)(?=\n\n|\n[^\n]|$)",
-            "参赛要求": r"参赛[要条件][求件][:：]?(.*?)(?=\n\n|\n[^\n]|$)",
-            "竞赛简介": r"[竞比赛][赛事]简介[:：]?(.*?)(?=\n\n|\n[^\n]|$)",
-            "提交材料": r"提交[材要][料求][:：]?(.*?)(?=\n\n|\n[^\n]|$)",
-            "奖项设置": r"奖[项励][设内]置[:：]?(.*?)(?=\n\n|\n[^\n]|$)",
-            "赛程安排": r"[赛比][程赛]安排[:：]?(.*?)(?=\n\n|\n[^\n]|$)",
-            "联系方式": r"联系方式[:：]?(.*?)(?=\n\n|\n[^\n]|$)"
-        }
+    def _read_saved_keywords(self) -> Optional[Dict[str, List[str]]]:
+        """
+        读取保存的竞赛关键词，文件不存在、损坏或与当前竞赛类型不一致时返回None
         
-        # 尝试每种模式进行提取
-        for info_type, pattern in patterns.items():
-            matches = re.search(pattern, content, re.DOTALL)
-            if matches:
-                info_text = matches.group(1).strip()
-                result[info_type] = info_text
+        Returns:
+            Dict: 按知识库中竞赛顺序排列的关键词表
+        """
+        if not self.keywords_file.exists():
+            return None
+        try:
+            with open(self.keywords_file, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取竞赛关键词失败，将重新分词: {e}")
+            return None
+        if set(saved) != set(self.kb):
+            return None
+        return {comp_type: saved[comp_type] for comp_type in self.kb}
+    
+    def _tokenize_competition_names(self) -> Dict[str, List[str]]:
+        """
+        对竞赛名称分词提取关键词，使用jieba时保存结果供下次启动直接读取
         
-        # 如果没有找到竞赛简介，尝试从开头提取
-        if "竞赛简介" not in result:
-            intro = content.split("\n\n")[0].strip()
-            if len(intro) > 50:  # 只有足够长的文本才视为简介
-                result["竞赛简介"] = intro
+        Returns:
+            Dict: 竞赛类型到关键词列表的映射
+        """
+        try:
+            import jieba
+        except ImportError:
+            # 未安装jieba时竞赛名称关键词只取名称中包含的别名
+            jieba = None
         
-        return result
-    
-    def _load_competition_keywords(self):
-        """加载竞赛关键词匹配表"""
-        self.competition_keywords = {}
+        keywords = {}
         for comp_type in self.kb:
             # 提取竞赛名称中的关键词
-            words = list(jieba.cut(comp_type))
-            significant_words = [w for w in words if len(w) > 1]  # 只保留多字符词
-            self.competition_keywords[comp_type] = significant_words
-    
-    def get_competition_type(self, question: str) -> Optional[str]:
-        """从问题中识别竞赛类型"""
-        # 直接匹配竞赛名称
-        for comp_type in self.kb:
-            if comp_type in question:
-                return comp_type
+            words = jieba.cut(comp_type) if jieba is not None else self._split_name(comp_type)
+            keywords[comp_type] = [w for w in words if len(w) > 1]  # 只保留多字符词
         
-        # 匹配竞赛别名
-        for alias, comp_type in self.competition_aliases.items():
-            if alias in question and comp_type in self.kb:
-                return comp_type
+        if jieba is not None:
+            try:
+                os.makedirs(os.path.dirname(self.keywords_file), exist_ok=True)
+                with open(self.keywords_file, 'w', encoding='utf-8') as f:
+                    json.dump(keywords, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                logger.warning(f"保存竞赛关键词失败: {e}")
+        return keywords
+    
+    def _split_name(self, comp_type: str) -> List[str]:
+        """取竞赛名称中包含的别名作为关键词，不依赖分词"""
+        return [alias for alias in self.competition_aliases if alias in comp_type]
+    
+    def _build_matchers(self):
+        """
+        把竞赛名称、别名、名称关键词和信息类型关键词编译为多模式匹配器，一次扫描问题即可得到全部命中
         
-        # 关键词匹配
-        matches = []
+        附加数据中的排序键保持原有优先级：完整名称 > 别名 > 名称关键词，
+        同一级别内关键词越长越优先，长度相同时按原遍历顺序
+        """
+        entries = []
+        for index, comp_type in enumerate(self.kb):
+            entries.append((comp_type, ((0, index), comp_type)))
+        for index, (alias, comp_type) in enumerate(self.competition_aliases.items()):
+            if comp_type in self.kb:
+                entries.append((alias, ((1, index), comp_type)))
+        index = 0
         for comp_type, keywords in self.competition_keywords.items():
             for keyword in keywords:
-                if keyword in question:
-                    matches.append((comp_type, len(keyword)))
+                entries.append((keyword, ((2, -len(keyword), index), comp_type)))
+                index += 1
+        self._competition_matcher = KeywordMatcher(entries)
         
-        # 返回匹配度最高的竞赛类型
-        if matches:
-            matches.sort(key=lambda x: x[1], reverse=True)  # 按关键词长度排序
-            return matches[0][0]
+        entries = []
+        index = 0
+        for info_type, keywords in self.info_types.items():
+            for keyword in keywords:
+                entries.append((keyword, ((-len(keyword), index), info_type)))
+                index += 1
+        self._info_type_matcher = KeywordMatcher(entries)
         
-        return None
+        # 匹配器构建后识别结果只取决于问题文本，按实例缓存，重建匹配器时缓存随之重建
+        self._competition_type_cache = lru_cache(maxsize=4096)(
+            partial(_best_match, self._competition_matcher)
+        )
+        self._info_type_cache = lru_cache(maxsize=4096)(
+            partial(_best_match, self._info_type_matcher)
+        )
+    
+    def get_competition_type(self, question: str) -> Optional[str]:
+        """从问题中识别竞赛类型"""
+        return self._competition_type_cache(question)
     
     def get_info_type(self, question: str) -> Optional[str]:
         """从问题中识别信息类型"""
-        # 遍历所有信息类型及其关键词
-        matches = []
-        for info_type, keywords in self.info_types.items():
-            for keyword in keywords:
-                if keyword in question:
-                    matches.append((info_type, len(keyword)))
-        
-        # 返回匹配度最高的信息类型
-        if matches:
-            matches.sort(key=lambda x: x[1], reverse=True)  # 按关键词长度排序
-            return matches[0][0]
-        
-        return None
+        return self._info_type_cache(question)
     
     def query(self, competition_type: Optional[str], info_type: Optional[str]) -> Optional[Dict[str, Any]]:
         """